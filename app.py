@@ -1,266 +1,334 @@
 import streamlit as st
-import base64
-from io import BytesIO
-from PIL import Image
-import requests
-from together import Together
+import os
+import time
+import uuid
+from pathlib import Path
+
+from nexus.clients import get_client, key_fingerprint
+from nexus.generation import (
+    expand_prompt,
+    generate_text,
+    image_params,
+    prompt_messages,
+    stream_completion,
+    text_messages,
+)
+from nexus.history import history
+from nexus.image_cache import image_cache
+from nexus.jobs import CANCELLED, DONE, FAILED, QUEUED, jobs, run_history_job, run_image_job
+from nexus.latency import SCHNELL_MODEL, latency_model
+from nexus.metrics import metrics, start_exporters, timed
+from nexus.postprocess import EXTENSIONS, OUTPUT_FORMATS
+from nexus.previews import digest, make_preview, output_format
+from nexus.prompt_cache import prompt_cache
+from nexus.scheduler import RequestDropped
+from nexus.similar import similar_prompts
+from nexus.sweep import RESOLUTIONS, STEP_CHOICES, SWEEP_MAX_CELLS, run_sweep_job, sweep_cells, sweep_rows
+from nexus.usage import QuotaExceeded, count_tokens, pixel_steps, usage
+
+STYLESHEET = Path(__file__).parent / "static" / "style.css"
+HISTORY_PAGE_SIZE = 12
+JOB_POLL_SECONDS = 1.0
+VISIBLE_JOBS = 5
+SWEEP_PREVIEW_SIZE = 256
+PREVIEW_STEPS = 4
+PREVIEW_RESOLUTION = 512
+
+@st.cache_data
+def read_stylesheet():
+    return STYLESHEET.read_text(encoding="utf-8")
 
 # Custom CSS injection for modern, futuristic styling
 def inject_css():
-    st.markdown("""
-    <style>
-        /* Main container styling */
-        .stApp {
-            background: linear-gradient(135deg, #0f0c29, #302b63, #24243e);
-            color: #ffffff;
-            font-family: 'Segoe UI', sans-serif;
-        }
-        
-        /* Header styling */
-        .stMarkdown h1 {
-            color: #00f5d4;
-            font-weight: 800;
-            text-shadow: 0 2px 15px rgba(0, 245, 212, 0.4);
-            letter-spacing: 0.5px;
-            margin-bottom: 0.5rem;
-        }
-        
-        /* Sidebar styling */
-        [data-testid="stSidebar"] {
-            background: rgba(15, 12, 41, 0.85) !important;
-            backdrop-filter: blur(10px);
-            border-right: 1px solid #00f5d433;
-        }
-        
-        /* Button styling */
-        .stButton>button {
-            background: linear-gradient(90deg, #00f5d4, #00bbf9);
-            border: none;
-            color: #0f0c29;
-            font-weight: 600;
-            border-radius: 12px;
-            box-shadow: 0 4px 20px rgba(0, 245, 212, 0.3);
-            transition: all 0.3s ease;
-            padding: 10px 24px;
-        }
-        
-        .stButton>button:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 6px 25px rgba(0, 245, 212, 0.5);
-        }
-        
-        /* FIXED: Text input styling for better visibility */
-        .stTextInput input,
-        .stTextArea textarea {
-            background: rgba(255, 255, 255, 0.15) !important;
-            color: #ffffff !important;
-            border: 2px solid #00f5d466 !important;
-            border-radius: 12px !important;
-            padding: 12px !important;
-            font-size: 14px !important;
-            font-weight: 500 !important;
-        }
-        
-        .stTextArea textarea::placeholder,
-        .stTextInput input::placeholder {
-            color: rgba(255, 255, 255, 0.6) !important;
-            font-weight: 400 !important;
-        }
-        
-        /* FIXED: Password input specific styling */
-        .stTextInput input[type="password"] {
-            background: rgba(255, 255, 255, 0.15) !important;
-            color: #ffffff !important;
-            border: 2px solid #00f5d466 !important;
-            font-weight: 500 !important;
-        }
-        
-        /* FIXED: Input focus states */
-        .stTextInput input:focus,
-        .stTextArea textarea:focus {
-            background: rgba(255, 255, 255, 0.2) !important;
-            border-color: #00f5d4 !important;
-            box-shadow: 0 0 0 3px rgba(0, 245, 212, 0.3) !important;
-            outline: none !important;
-            color: #ffffff !important;
-        }
-        
-        /* Select box styling - FIXED for visibility */
-        .stSelectbox select {
-            background: rgba(255, 255, 255, 0.15) !important;
-            color: #ffffff !important;
-            border: 2px solid #00f5d466 !important;
-            border-radius: 12px !important;
-            padding: 8px !important;
-            font-size: 14px !important;
-            font-weight: 500 !important;
-        }
-        
-        .stSelectbox > div > div {
-            background: rgba(255, 255, 255, 0.15) !important;
-            color: #ffffff !important;
-            border: 2px solid #00f5d466 !important;
-        }
-        
-        /* Dropdown options styling */
-        .stSelectbox [data-baseweb="select"] {
-            background: rgba(15, 12, 41, 0.95) !important;
-        }
-        
-        .stSelectbox [role="option"] {
-            background: rgba(15, 12, 41, 0.95) !important;
-            color: white !important;
-        }
-        
-        .stSelectbox [role="option"]:hover {
-            background: rgba(0, 245, 212, 0.2) !important;
-            color: white !important;
-        }
-        
-        /* Slider styling */
-        .stSlider .thumb {
-            background: #00f5d4 !important;
-            border: none !important;
-            box-shadow: 0 0 10px rgba(0, 245, 212, 0.5);
-        }
-        
-        .stSlider .track {
-            background: #00bbf9 !important;
-            height: 6px;
-            border-radius: 3px;
-        }
-        
-        /* Card styling for generated content */
-        .generated-card {
-            background: rgba(15, 12, 41, 0.7);
-            border-radius: 16px;
-            padding: 20px;
-            border: 1px solid #00f5d433;
-            box-shadow: 0 8px 32px rgba(0, 0, 0, 0.3);
-            margin-bottom: 25px;
-            transition: all 0.3s ease;
-            color: white;
-        }
-        
-        .generated-card:hover {
-            transform: translateY(-5px);
-            box-shadow: 0 12px 40px rgba(0, 245, 212, 0.2);
-        }
-        
-        /* Tab styling */
-        .stTabs [data-baseweb="tab-list"] {
-            gap: 10px;
-            padding: 0 20px;
-        }
-        
-        .stTabs [data-baseweb="tab"] {
-            background: rgba(15, 12, 41, 0.7);
-            border-radius: 12px !important;
-            padding: 12px 24px;
-            transition: all 0.3s ease;
-            margin: 0 5px;
-            color: rgba(255, 255, 255, 0.7);
-            font-weight: 500;
-        }
-        
-        .stTabs [aria-selected="true"] {
-            background: linear-gradient(90deg, #00f5d4, #00bbf9) !important;
-            color: #0f0c29 !important;
-            font-weight: 600;
-            box-shadow: 0 4px 15px rgba(0, 245, 212, 0.3);
-        }
-        
-        /* Labels and text styling */
-        .stMarkdown p, .stMarkdown li {
-            color: rgba(255, 255, 255, 0.9) !important;
-        }
-        
-        label {
-            color: white !important;
-            font-weight: 500 !important;
-        }
-        
-        /* Help text styling */
-        .stMarkdown small {
-            color: rgba(255, 255, 255, 0.6) !important;
-        }
-        
-        /* Expander styling */
-        .streamlit-expanderHeader {
-            background: rgba(255, 255, 255, 0.05) !important;
-            color: white !important;
-            border-radius: 8px !important;
-        }
-        
-        .streamlit-expanderContent {
-            background: rgba(255, 255, 255, 0.02) !important;
-            border-radius: 0 0 8px 8px !important;
-        }
-        
-        /* Tooltip styling */
-        .stTooltip {
-            background: #0f0c29 !important;
-            border: 1px solid #00f5d4 !important;
-            border-radius: 8px;
-            box-shadow: 0 4px 20px rgba(0, 0, 0, 0.3);
-        }
-        
-        /* Spinner styling */
-        .stSpinner > div {
-            border: 3px solid rgba(0, 245, 212, 0.3);
-            border-radius: 50%;
-            border-top: 3px solid #00f5d4;
-            width: 30px;
-            height: 30px;
-        }
-        
-        /* Success/Error message styling */
-        .stSuccess {
-            background: rgba(0, 245, 212, 0.1) !important;
-            border: 1px solid rgba(0, 245, 212, 0.3) !important;
-            color: white !important;
-        }
-        
-        .stError {
-            background: rgba(255, 82, 82, 0.1) !important;
-            border: 1px solid rgba(255, 82, 82, 0.3) !important;
-            color: white !important;
-        }
-        
-        .stWarning {
-            background: rgba(255, 193, 7, 0.1) !important;
-            border: 1px solid rgba(255, 193, 7, 0.3) !important;
-            color: white !important;
-        }
-        
-        .stInfo {
-            background: rgba(0, 123, 255, 0.1) !important;
-            border: 1px solid rgba(0, 123, 255, 0.3) !important;
-            color: white !important;
-        }
-        
-        /* Footer styling */
-        .footer {
-            margin-top: 50px;
-            text-align: center;
-            color: rgba(255, 255, 255, 0.5);
-            font-size: 0.9em;
-            padding: 20px 0;
-            border-top: 1px solid rgba(0, 245, 212, 0.2);
-        }
+    # With static serving on (see .streamlit/config.toml) each rerun only sends
+    # a <link>; the browser fetches and caches the stylesheet once
+    inline = os.environ.get("NEXUS_INLINE_CSS")
+    if inline is None:
+        inline = "0" if st.get_option("server.enableStaticServing") else "1"
+    if inline == "1":
+        st.markdown(f"<style>{read_stylesheet()}</style>", unsafe_allow_html=True)
+    else:
+        st.markdown('<link rel="stylesheet" href="app/static/style.css">', unsafe_allow_html=True)
+
+def render_image(slot, i, result, key=None):
+    """Render one generated image (bytes or URL) into its grid slot.
+    
+    Encoded bytes are handed to st.image as-is, so Streamlit forwards them
+    without decoding and re-encoding. The grid shows a downscaled preview
+    and the original is only sent when the user asks for it.
+    """
+    with slot.container(), timed("render"):
+        st.markdown('<div class="generated-card">', unsafe_allow_html=True)
+        
+        try:
+            if isinstance(result, bytes):
+                full_res = st.toggle(
+                    "🔍 Full resolution",
+                    key=key or f"full_res_{i}_{digest(result)[:16]}"
+                )
+                data = result if full_res else make_preview(result)
+                
+                # Display the image
+                st.image(
+                    data,
+                    caption=f"🎨 Variation {i+1}",
+                    use_container_width=True,
+                    output_format=output_format(data)
+                )
+            
+            elif result:
+                st.image(result, caption=f"Generated Image {i+1}")
+            
+            else:
+                st.error("Unable to process image data")
         
-        /* Custom glowing effect for important elements */
-        .glow-effect {
-            box-shadow: 0 0 15px rgba(0, 245, 212, 0.5);
-            animation: glow-pulse 2s infinite alternate;
-        }
+        except Exception as img_error:
+            st.error(f"Error processing image: {str(img_error)}")
         
-        @keyframes glow-pulse {
-            0% { box-shadow: 0 0 10px rgba(0, 245, 212, 0.3); }
-            100% { box-shadow: 0 0 20px rgba(0, 245, 212, 0.7); }
-        }
-    </style>
-    """, unsafe_allow_html=True)
+        st.markdown('</div>', unsafe_allow_html=True)
+
+def render_job(job):
+    """Show one image job: its progress while running, then its results."""
+    label = job.params["prompt"][:80] + ("…" if len(job.params["prompt"]) > 80 else "")
+    total = len(job.results)
+    
+    if job.status == QUEUED:
+        st.info(f"⏳ Queued: {label}")
+    elif job.active:
+        st.progress(job.completed / total, text=f"🎨 Painting {job.completed}/{total}: {label}")
+    elif job.status == DONE:
+        generated = sum(result is not None for result in job.results)
+        if job.kind == "sweep":
+            st.success(f"🧪 Sweep finished: {generated}/{total} image(s), {job.cached} from cache, in {job.seconds:.1f}s")
+        elif job.from_cache:
+            st.success(f"♻️ Loaded {generated} cached image(s)!")
+        elif job.errors:
+            st.warning(f"Generated {generated} of {total} image(s) in {job.seconds:.1f}s")
+        else:
+            st.success(f"🎉 Generated {generated} image(s) in {job.seconds:.1f}s!")
+    elif job.status == FAILED:
+        st.error(f"🚨 Image generation failed: {str(job.error)}")
+        if isinstance(job.error, QuotaExceeded):
+            st.info("📊 See the Usage panel in the sidebar for what this session and key have used.")
+        elif "api_key" in str(job.error).lower():
+            st.info("Please verify your API key is correct")
+        elif isinstance(job.error, RequestDropped) or "rate limit" in str(job.error).lower():
+            st.info("You've hit the rate limit. Please wait before trying again.")
+    elif job.status == CANCELLED:
+        st.caption(f"🛑 Cancelled: {label}")
+        return
+    
+    if job.active and st.button("🛑 Cancel", key=f"cancel_{job.id}"):
+        jobs.cancel(job.id)
+    
+    if job.released:
+        st.caption("📦 Released from memory to stay within the image budget; it's still in 🗂️ History.")
+        if job.generation_id and st.button("📂 Open in History", key=f"open_{job.id}"):
+            st.session_state.history_view = job.generation_id
+            st.rerun()
+        return
+    
+    if job.kind == "sweep":
+        render_sweep(job)
+        return
+    
+    # Slots still waiting for their final image show the quick preview, if it's ready
+    preview = jobs.get(job.preview_id) if job.preview_id and job.active else None
+    preview_image = preview.results[0] if preview and preview.results and isinstance(preview.results[0], bytes) else None
+    if preview_image is not None:
+        st.caption("⚡ Quick preview shown until the full render replaces it. Not what you wanted? 🛑 Cancel to skip the rest.")
+    
+    # Fill each slot as soon as its image arrives
+    cols = st.columns(2)
+    for i, result in enumerate(job.results):
+        if i in job.processed:
+            # Post-processed version, with its per-stage timings and a download
+            data, timings = job.processed[i]
+            fmt = job.postprocess["format"]
+            render_image(cols[i % 2].empty(), i, data, key=f"full_res_{job.id}_{i}")
+            cols[i % 2].caption("⚙️ " + " · ".join(f"{stage} {seconds * 1000:.0f}ms" for stage, seconds in timings))
+            cols[i % 2].download_button(
+                f"⬇️ {fmt} ({len(data) // 1024:,} KB)",
+                data,
+                file_name=f"nexus_{job.id}_{i + 1}.{EXTENSIONS[fmt]}",
+                key=f"download_{job.id}_{i}"
+            )
+        elif result is not None:
+            render_image(cols[i % 2].empty(), i, result, key=f"full_res_{job.id}_{i}")
+        elif i in job.errors and job.status != FAILED:
+            cols[i % 2].error(f"Variation {i+1} failed: {job.errors[i]}")
+        elif preview_image is not None:
+            cols[i % 2].image(preview_image, caption=f"⚡ Preview {i+1}", use_container_width=True)
+
+def render_sweep(job):
+    """Comparison matrix of a sweep: steps across, one row per prompt/model/resolution."""
+    columns, rows = sweep_rows(job.params["cells"])
+    header = st.columns([1] + [2] * len(columns))
+    for col, steps_value in zip(header[1:], columns):
+        col.markdown(f"**{steps_value} steps**")
+    
+    for cell, indexes in rows:
+        row = st.columns([1] + [2] * len(columns))
+        row[0].caption(f"**{cell['model'].split('/')[-1]}** · {cell['width']}x{cell['height']}\n\n{cell['prompt'][:60]}")
+        for col, index in zip(row[1:], indexes):
+            if index is None:
+                continue
+            result = job.results[index]
+            if isinstance(result, bytes):
+                preview = make_preview(result, SWEEP_PREVIEW_SIZE)
+                col.image(preview, use_container_width=True, output_format=output_format(preview))
+            elif result:
+                col.image(result, use_container_width=True)
+            elif index in job.errors:
+                col.error(job.errors[index][:120])
+            elif job.active:
+                col.caption("⏳")
+
+def preview_size(width, height):
+    """Preview resolution: the long side scaled to PREVIEW_RESOLUTION, keeping the aspect ratio."""
+    scale = PREVIEW_RESOLUTION / max(width, height)
+    return max(64, round(width * scale / 64) * 64), max(64, round(height * scale / 64) * 64)
+
+def submit_preview(client, session, params, use_cache):
+    """Queue a quick FLUX.1-schnell render of ``params`` ahead of the full one.
+
+    Returns the preview job, or None when the full render is quick or cached anyway.
+    """
+    if params["model"] == SCHNELL_MODEL and params["steps"] <= PREVIEW_STEPS:
+        return None
+    if use_cache and params in image_cache:
+        return None
+    width, height = preview_size(params["width"], params["height"])
+    return jobs.submit(
+        run_image_job,
+        image_params(
+            params["prompt"],
+            model=SCHNELL_MODEL,
+            steps=PREVIEW_STEPS,
+            n=1,
+            width=width,
+            height=height,
+            negative_prompt=params.get("negative_prompt", "")
+        ),
+        session=session,
+        kind="preview",
+        client=client,
+        use_cache=use_cache,
+        record=False
+    )
+
+def show_jobs(polling):
+    """Body of the image job panel, run as a fragment so polling doesn't rerun the page."""
+    session_jobs = [job for job in map(jobs.get, st.session_state.get('image_jobs', [])) if job]
+    if not session_jobs:
+        return
+    
+    if polling and not any(job.active for job in session_jobs):
+        st.rerun()  # everything finished: rerun the page once to stop polling
+    
+    st.markdown("#### 🖼️ Latest Images")
+    for job in session_jobs[:VISIBLE_JOBS]:
+        with st.container(border=True):
+            render_job(job)
+    
+    if any(not job.active for job in session_jobs) and st.button("🧹 Clear finished"):
+        st.session_state.image_jobs = [job.id for job in session_jobs if job.active]
+        st.rerun()
+
+def show_usage(api_key, session):
+    """Body of the usage panel: what this session and this key used, against their quotas."""
+    accounts = usage.usage(key_fingerprint(api_key) if api_key else None, session)
+    for scope, title in (("session", "This session"), ("key", "This API key")):
+        account = accounts.get(scope)
+        if account is None:
+            continue
+        st.markdown(f"**{title}**")
+        col_a, col_b = st.columns(2)
+        col_a.metric("🖼️ Images", account["images"])
+        col_b.metric("🧮 MP-steps", f"{account['pixel_steps'] / 1e6:,.0f}", help="Megapixels × steps rendered")
+        col_a.metric(
+            "🔤 Tokens",
+            f"{account['tokens_in'] + account['tokens_out']:,}",
+            help=f"{account['tokens_in']:,} in / {account['tokens_out']:,} out"
+        )
+        col_b.metric("⏱️ API time", f"{account['seconds']:.1f}s")
+        if account["saved_images"] or account["saved_tokens"]:
+            st.caption(
+                f"♻️ Caches saved {account['saved_images']} image(s) "
+                f"({account['saved_pixel_steps'] / 1e6:,.0f} MP-steps) and ~{account['saved_tokens']:,} tokens"
+            )
+        if account["quota_pixel_steps"]:
+            st.progress(
+                min(1.0, account["window_pixel_steps"] / account["quota_pixel_steps"]),
+                text=f"Images: {account['window_pixel_steps'] / 1e6:,.0f} / {account['quota_pixel_steps'] / 1e6:,.0f} MP-steps"
+            )
+        if account["quota_tokens"]:
+            st.progress(
+                min(1.0, account["window_tokens"] / account["quota_tokens"]),
+                text=f"Tokens: {account['window_tokens']:,} / {account['quota_tokens']:,}"
+            )
+        if account["quota_pixel_steps"] or account["quota_tokens"]:
+            st.caption(f"⏳ Quota resets in {account['window_resets_in'] / 60:.0f} min")
+
+def craft_prompt(api_key, session, idea, model, stream, fresh=False):
+    """Expand ``idea`` into a detailed image prompt and show it.
+    
+    Ideas repeat a lot across users, so expansions are shared through the
+    prompt cache unless ``fresh`` is set.
+    """
+    generated_prompt = None if fresh else prompt_cache.get(model, idea)
+    if generated_prompt is not None:
+        usage.record_saved(key_fingerprint(api_key), session, tokens=sum(count_tokens(prompt_messages(idea), generated_prompt)))
+        st.success("✨ Here's your AI-crafted prompt:")
+        st.markdown(f'<div class="generated-card compact">{generated_prompt}</div>', unsafe_allow_html=True)
+        return generated_prompt
+    
+    client = get_client(api_key, session=session)
+    started = time.perf_counter()
+    
+    if stream:
+        st.success("✨ Here's your AI-crafted prompt:")
+        generated_prompt, _ = stream_chat(
+            client,
+            st.empty(),
+            card_class="generated-card compact",
+            stage="prompt",
+            model=model,
+            messages=prompt_messages(idea)
+        )
+    else:
+        with st.spinner("🧠 Crafting the perfect prompt for you..."):
+            generated_prompt = expand_prompt(client, model, idea)
+        st.success("✨ Here's your AI-crafted prompt:")
+        st.markdown(f'<div class="generated-card compact">{generated_prompt}</div>', unsafe_allow_html=True)
+    
+    prompt_cache.put(model, idea, generated_prompt)
+    history.record_text(
+        "prompt",
+        idea,
+        generated_prompt,
+        params={"model": model},
+        seconds=time.perf_counter() - started,
+        session=session,
+        owner=key_fingerprint(api_key)
+    )
+    return generated_prompt
+
+def stream_chat(client, placeholder, card_class="generated-card", **request):
+    """Stream a chat completion into ``placeholder``; returns (text, seconds to first token)."""
+    started = time.perf_counter()
+    ttft = None
+    text = ""
+    placeholder.markdown(f'<div class="{card_class}">▌</div>', unsafe_allow_html=True)
+    
+    for delta in stream_completion(client, **request):
+        if ttft is None:
+            ttft = time.perf_counter() - started
+        text += delta
+        placeholder.markdown(f'<div class="{card_class}">{text}▌</div>', unsafe_allow_html=True)
+    
+    placeholder.markdown(f'<div class="{card_class}">{text}</div>', unsafe_allow_html=True)
+    return text, ttft if ttft is not None else time.perf_counter() - started
 
 # Page configuration
 st.set_page_config(
@@ -273,11 +341,17 @@ st.set_page_config(
 # Inject custom CSS
 inject_css()
 
+# Prometheus endpoint / JSON sink, when configured (started once per process)
+start_exporters()
+
+# Identifies this browser session for fair queueing of provider requests
+session_id = st.session_state.setdefault('session_id', uuid.uuid4().hex)
+
 # Title and description with modern layout
 st.markdown("""
-<div style="padding: 20px 0 30px 0; border-bottom: 1px solid rgba(0, 245, 212, 0.2);">
-    <h1 style="margin-bottom: 0.2rem;">🚀 NexusAI Studio</h1>
-    <p style="color: rgba(255, 255, 255, 0.7); font-size: 1.1em;">
+<div class="app-header">
+    <h1>🚀 NexusAI Studio</h1>
+    <p>
         Your all-in-one AI creative suite for text and image generation
     </p>
 </div>
@@ -286,9 +360,9 @@ st.markdown("""
 # Sidebar for API key and settings
 with st.sidebar:
     st.markdown("""
-    <div style="padding-bottom: 20px; border-bottom: 1px solid rgba(0, 245, 212, 0.2); margin-bottom: 20px;">
-        <h2 style="color: #00f5d4; margin-bottom: 5px;">⚙️ Configuration</h2>
-        <p style="color: rgba(255, 255, 255, 0.6); font-size: 0.9em;">
+    <div class="sidebar-header">
+        <h2>⚙️ Configuration</h2>
+        <p>
             Configure your API keys and settings
         </p>
     </div>
@@ -301,6 +375,8 @@ with st.sidebar:
         help="Get your API key from https://api.together.xyz/",
         placeholder="Enter your API key here..."
     )
+    # History is kept per key: each user only sees what their own key generated
+    owner = key_fingerprint(api_key) if api_key else None
     
     # Model selection tabs
     tab_model_text, tab_model_image = st.tabs(["📝 Text", "🖼️ Image"])
@@ -313,9 +389,15 @@ with st.sidebar:
             help="Select model for text generation"
         )
         
+        stream_responses = st.toggle(
+            "🌊 Stream responses",
+            value=True,
+            help="Show text as it is generated instead of waiting for the full response"
+        )
+        
         st.markdown(f"""
-        <div style="background: rgba(0, 245, 212, 0.1); padding: 12px; border-radius: 8px; margin-top: 10px;">
-            <p style="margin: 0; color: rgba(255, 255, 255, 0.8); font-size: 0.85em;">
+        <div class="model-info">
+            <p>
                 <strong>Current:</strong> {text_model}<br>
                 <strong>Best for:</strong> General text generation and prompt crafting
             </p>
@@ -332,8 +414,8 @@ with st.sidebar:
         
         purpose = "High-quality images" if image_model == "black-forest-labs/FLUX.1-dev" else "Fast generation"
         st.markdown(f"""
-        <div style="background: rgba(0, 245, 212, 0.1); padding: 12px; border-radius: 8px; margin-top: 10px;">
-            <p style="margin: 0; color: rgba(255, 255, 255, 0.8); font-size: 0.85em;">
+        <div class="model-info">
+            <p>
                 <strong>Current:</strong> {image_model}<br>
                 <strong>Best for:</strong> {purpose}
             </p>
@@ -373,12 +455,97 @@ with st.sidebar:
                 index=2,
                 help="Image height in pixels"
             )
+        st.caption(f"🧮 {pixel_steps({'width': width, 'height': height, 'steps': steps, 'n': num_images}) / 1e6:,.0f} megapixel-steps per run")
+        
+        use_image_cache = st.checkbox(
+            "♻️ Reuse cached results",
+            value=True,
+            help="Serve identical requests from the local cache instead of generating (and paying) again"
+        )
+        
+        parallel_requests = st.slider(
+            "⚡ Parallel Requests",
+            min_value=1,
+            max_value=4,
+            value=4,
+            help="Request variations one by one in parallel so each shows up as soon as it's ready (1 = single batched request)"
+        )
+        
+        progressive_preview = st.toggle(
+            "⚡ Progressive preview",
+            value=True,
+            help=f"Show a quick {PREVIEW_STEPS}-step FLUX.1-schnell render at {PREVIEW_RESOLUTION}px first; the full render replaces it when it's done"
+        )
+        
+        use_latency_budget = st.toggle(
+            "⏱️ Latency budget",
+            value=False,
+            help="Pick the model, steps and resolution automatically from measured latencies"
+        )
+        auto_config = None
+        if use_latency_budget:
+            latency_budget = st.slider(
+                "🎯 Target seconds",
+                min_value=1,
+                max_value=60,
+                value=5,
+                help="The best quality expected to finish within this time is used"
+            )
+            auto_config = latency_model.choose(
+                latency_budget,
+                width=width,
+                height=height,
+                n=num_images,
+                parallel=parallel_requests
+            )
+            summary = (
+                f"{auto_config['model'].split('/')[-1]} · {auto_config['steps']} steps · "
+                f"{auto_config['width']}x{auto_config['height']} (≈{auto_config['predicted']:.1f}s)"
+            )
+            if auto_config["within_budget"]:
+                st.caption(f"🤖 Auto: {summary}")
+            else:
+                st.warning(f"🐢 Nothing is expected to fit {latency_budget}s; using the fastest option: {summary}")
+    
+    # Optional post-processing, run on a process pool as images arrive
+    with st.expander("🛠️ Post-processing"):
+        use_postprocess = st.toggle(
+            "Enable post-processing",
+            value=False,
+            help="Upscale, adjust, watermark and re-encode every generated image"
+        )
+        upscale_factor = st.select_slider("🔍 Upscale", options=[1, 2, 4], value=1, format_func=lambda f: f"{f}x")
+        auto_levels = st.checkbox("🌗 Auto levels", value=False)
+        watermark_text = st.text_input("©️ Watermark", placeholder="Leave empty for none")
+        max_side = st.selectbox(
+            "📐 Fit within",
+            [0, 512, 1024, 2048],
+            format_func=lambda side: "Original size" if not side else f"{side}px"
+        )
+        output_fmt = st.selectbox("💾 Format", OUTPUT_FORMATS, index=0)
+        output_quality = st.slider("🎚️ Quality", min_value=40, max_value=100, value=80)
+        
+        postprocess = None
+        if use_postprocess:
+            pipeline = []
+            if upscale_factor > 1:
+                pipeline.append(("upscale", float(upscale_factor)))
+            if auto_levels:
+                pipeline.append(("levels", 1.0))
+            if watermark_text.strip():
+                pipeline.append(("watermark", watermark_text.strip()))
+            if max_side:
+                pipeline.append(("thumbnail", max_side))
+            postprocess = {"steps": pipeline, "format": output_fmt, "quality": output_quality}
+    
+    # Usage of this session and key; filled in at the end of the script, after this run's requests
+    usage_panel = st.expander("📊 Usage")
     
     # Quick tips section
     st.markdown("""
-    <div style="margin-top: 30px; padding: 15px; background: rgba(0, 245, 212, 0.1); border-radius: 8px;">
-        <h4 style="color: #00f5d4; margin-bottom: 10px;">💡 Pro Tips</h4>
-        <ul style="color: rgba(255, 255, 255, 0.7); font-size: 0.85em; padding-left: 20px; margin: 0;">
+    <div class="pro-tips">
+        <h4>💡 Pro Tips</h4>
+        <ul>
             <li>Generate a text prompt first if you're unsure</li>
             <li>Use 20-30 steps for best quality/speed balance</li>
             <li>1024x1024 works best for detailed images</li>
@@ -387,17 +554,37 @@ with st.sidebar:
     </div>
     """, unsafe_allow_html=True)
 
+    # Debug panel, shown with ?debug=1 in the URL
+    if st.query_params.get("debug") == "1":
+        with st.expander("📈 Metrics"):
+            snapshot = metrics.snapshot()
+            st.dataframe(
+                [
+                    {
+                        "metric": h["name"],
+                        **h["labels"],
+                        "count": h["count"],
+                        "p50": round(h["p50"], 3),
+                        "p95": round(h["p95"], 3),
+                        "p99": round(h["p99"], 3),
+                    }
+                    for h in snapshot["histograms"]
+                ],
+                use_container_width=True
+            )
+            st.json({g["name"]: g["value"] for g in snapshot["gauges"]})
+
 # Main content area with tabs
-tab1, tab2 = st.tabs(["🎨 Generate", "📚 Guide"])
+tab1, tab_history, tab2 = st.tabs(["🎨 Generate", "🗂️ History", "📚 Guide"])
 
 with tab1:
     col1, col2 = st.columns([1, 2], gap="large")
     
     with col1:
         st.markdown("""
-        <div style="margin-bottom: 20px;">
-            <h3 style="color: #00f5d4; margin-bottom: 5px;">🧠 Creative Studio</h3>
-            <p style="color: rgba(255, 255, 255, 0.7); font-size: 0.9em;">
+        <div class="section-title">
+            <h3>🧠 Creative Studio</h3>
+            <p>
                 Craft your prompt or let AI help you generate one
             </p>
         </div>
@@ -413,20 +600,40 @@ with tab1:
                 key="prompt_idea"
             )
             
-            generate_prompt_btn = st.button(
-                "🪄 Generate Professional Prompt",
+            col_prompt_1, col_prompt_2 = st.columns([3, 1])
+            with col_prompt_1:
+                generate_prompt_btn = st.button(
+                    "🪄 Generate Professional Prompt",
+                    disabled=not api_key,
+                    use_container_width=True
+                )
+            with col_prompt_2:
+                regenerate_prompt_btn = st.button(
+                    "🔄 Regenerate",
+                    disabled=not api_key,
+                    use_container_width=True,
+                    help="Ask the model for a fresh prompt instead of reusing a cached one"
+                )
+            
+            pipeline_btn = st.button(
+                "⚡ Idea → Images",
                 disabled=not api_key,
-                use_container_width=True
+                use_container_width=True,
+                help="Craft the prompt and start rendering it as soon as it's written, in one click"
             )
         
+        # A freshly crafted prompt replaces the box contents. Handlers run after the
+        # box is drawn, so they leave it in session state for the next run
+        if st.session_state.get('generated_prompt'):
+            st.session_state.main_prompt = st.session_state.pop('generated_prompt')
+        
         # Main prompt input
         prompt = st.text_area(
             "**Your Final Prompt**",
             height=150,
             placeholder="Example: 'A futuristic cyberpunk cityscape at night, neon lights reflecting on wet streets, 4K hyper-detailed'",
             help="This will be used for image generation",
-            key="main_prompt",
-            value=st.session_state.get('generated_prompt', '')
+            key="main_prompt"
         )
         
         # Negative prompt
@@ -454,141 +661,264 @@ with tab1:
                 use_container_width=True
             )
         
+        # Offer earlier renders of near-identical prompts before spending credits on a new one
+        if prompt.strip():
+            matches = similar_prompts.query(prompt, limit=3, owner=owner) if owner else []
+            if matches:
+                with st.expander(f"♻️ {len(matches)} similar prompt(s) already rendered", expanded=True):
+                    for similarity, generation_id, match_prompt in matches:
+                        entry = history.get(generation_id, owner=owner)
+                        if not entry:
+                            continue
+                        st.caption(f"**{similarity:.0%} match:** {match_prompt[:120]}")
+                        thumbs = [history.thumbnail(image["sha"]) for image in entry["images"] if image["sha"]]
+                        thumbs = [thumb for thumb in thumbs if thumb]
+                        if thumbs:
+                            st.image(thumbs, width=80)
+                        if st.button("♻️ Show these results", key=f"reuse_{generation_id}"):
+                            job = jobs.submit(
+                                run_history_job,
+                                dict(entry["params"], n=len(entry["images"])),
+                                session=session_id,
+                                generation_id=generation_id,
+                                owner=owner
+                            )
+                            st.session_state.setdefault('image_jobs', []).insert(0, job.id)
+        
+        # Sweep mode: one image per combination, laid out as a comparison grid
+        with st.expander("🧪 Sweep Mode"):
+            sweep_prompts = st.text_area(
+                "**Prompt variants** (one per line)",
+                height=100,
+                placeholder="Leave empty to sweep your final prompt",
+                key="sweep_prompts"
+            )
+            sweep_models = st.multiselect(
+                "Models",
+                ["black-forest-labs/FLUX.1-dev", "black-forest-labs/FLUX.1-schnell"],
+                default=["black-forest-labs/FLUX.1-dev", "black-forest-labs/FLUX.1-schnell"]
+            )
+            sweep_steps = st.multiselect("Steps", STEP_CHOICES, default=[4, 20])
+            sweep_resolutions = st.multiselect("Resolutions", RESOLUTIONS, default=["1024x1024"])
+            
+            variants = [line.strip() for line in sweep_prompts.splitlines() if line.strip()] or [prompt.strip()]
+            cells = sweep_cells(
+                [variant for variant in variants if variant],
+                sweep_models,
+                sweep_steps,
+                sweep_resolutions,
+                negative_prompt=negative_prompt
+            )
+            st.caption(f"{len(cells)} image(s), up to {parallel_requests} at a time (max {SWEEP_MAX_CELLS})")
+            
+            run_sweep_btn = st.button(
+                "🧪 Run Sweep",
+                disabled=not api_key or not cells or len(cells) > SWEEP_MAX_CELLS,
+                use_container_width=True
+            )
+        
         if not api_key:
             st.warning("Please enter your API key to enable generation")
     
     with col2:
         st.markdown("""
-        <div style="margin-bottom: 20px;">
-            <h3 style="color: #00f5d4; margin-bottom: 5px;">🎭 Output</h3>
-            <p style="color: rgba(255, 255, 255, 0.7); font-size: 0.9em;">
+        <div class="section-title">
+            <h3>🎭 Output</h3>
+            <p>
                 Your generated content will appear here
             </p>
         </div>
         """, unsafe_allow_html=True)
         
         # Handle prompt generation
-        if generate_prompt_btn and prompt_idea.strip():
+        if (generate_prompt_btn or regenerate_prompt_btn) and prompt_idea.strip():
             if not api_key:
                 st.error("Please enter your API key")
             else:
                 try:
-                    with st.spinner("🧠 Crafting the perfect prompt for you..."):
-                        client = Together(api_key=api_key)
-                        response = client.chat.completions.create(
-                            model=text_model,
-                            messages=[
-                                {
-                                    "role": "system",
-                                    "content": "You are a professional prompt engineer for AI image generation. Create a detailed, creative prompt based on the user's simple idea. Include style, composition, lighting, and artistic details. Respond with just the prompt text, no additional commentary."
-                                },
-                                {
-                                    "role": "user",
-                                    "content": f"Create a professional AI image generation prompt for: {prompt_idea}"
-                                }
-                            ]
-                        )
-                        generated_prompt = response.choices[0].message.content
-                        st.session_state.generated_prompt = generated_prompt
-                    
-                    st.success("✨ Here's your AI-crafted prompt:")
-                    st.markdown(f'<div class="generated-card" style="padding: 15px; margin-bottom: 20px;">{generated_prompt}</div>', unsafe_allow_html=True)
-                    
+                    st.session_state.generated_prompt = craft_prompt(
+                        api_key,
+                        session_id,
+                        prompt_idea,
+                        text_model,
+                        stream_responses,
+                        fresh=regenerate_prompt_btn
+                    )
                     st.rerun()  # Refresh to show the prompt in the text area
                 
                 except Exception as e:
                     st.error(f"Failed to generate prompt: {str(e)}")
         
+        # One-click pipeline: expand the idea, then dispatch the render the moment the prompt is done
+        if pipeline_btn and prompt_idea.strip():
+            try:
+                generated_prompt = craft_prompt(api_key, session_id, prompt_idea, text_model, stream_responses)
+                st.session_state.generated_prompt = generated_prompt
+                client = get_client(api_key, session=session_id)
+                config = auto_config or {"model": image_model, "steps": steps, "width": width, "height": height}
+                generation_params = image_params(
+                    generated_prompt,
+                    model=config["model"],
+                    steps=config["steps"],
+                    n=num_images,
+                    width=config["width"],
+                    height=config["height"],
+                    negative_prompt=negative_prompt
+                )
+                
+                # A quick schnell render goes first and fills the card until the final images land
+                preview = submit_preview(client, session_id, generation_params, use_image_cache) if progressive_preview else None
+                job = jobs.submit(
+                    run_image_job,
+                    generation_params,
+                    session=session_id,
+                    preview_id=preview.id if preview else None,
+                    client=client,
+                    parallel=parallel_requests,
+                    use_cache=use_image_cache,
+                    postprocess=postprocess
+                )
+                st.session_state.setdefault('image_jobs', []).insert(0, job.id)
+            
+            except Exception as e:
+                st.error(f"Failed to generate prompt: {str(e)}")
+        
         # Handle text generation
         if generate_text_btn and prompt.strip():
             try:
-                with st.spinner("💡 Generating creative text..."):
-                    client = Together(api_key=api_key)
-                    response = client.chat.completions.create(
+                client = get_client(api_key, session=session_id)
+                started = time.perf_counter()
+                
+                if stream_responses:
+                    st.success("📚 Generated Text:")
+                    generated_text, ttft = stream_chat(
+                        client,
+                        st.empty(),
                         model=text_model,
-                        messages=[
-                            {"role": "user", "content": prompt}
-                        ],
+                        messages=text_messages(prompt),
                         max_tokens=1024
                     )
-                    generated_text = response.choices[0].message.content
-                    st.session_state.generated_text = generated_text
+                    st.caption(f"⏱️ First token after {ttft:.2f}s")
+                else:
+                    with st.spinner("💡 Generating creative text..."):
+                        generated_text = generate_text(client, text_model, prompt)
+                    
+                    st.success("📚 Generated Text:")
+                    st.markdown(f'<div class="generated-card">{generated_text}</div>', unsafe_allow_html=True)
                 
-                st.success("📚 Generated Text:")
-                st.markdown(f'<div class="generated-card">{generated_text}</div>', unsafe_allow_html=True)
+                st.session_state.generated_text = generated_text
+                history.record_text(
+                    "text",
+                    prompt,
+                    generated_text,
+                    params={"model": text_model, "max_tokens": 1024},
+                    seconds=time.perf_counter() - started,
+                    session=session_id,
+                    owner=owner
+                )
             
             except Exception as e:
                 st.error(f"Failed to generate text: {str(e)}")
         
-        # Handle image generation
+        # Handle image generation: queue a background job and return right away
         if generate_image_btn and prompt.strip():
-            try:
-                client = Together(api_key=api_key)
-                
-                with st.spinner("🎨 Painting your vision... This may take a moment"):
-                    generation_params = {
-                        "prompt": prompt,
-                        "model": image_model,
-                        "steps": steps,
-                        "n": num_images,
-                        "width": width,
-                        "height": height
-                    }
-                    
-                    if negative_prompt.strip():
-                        generation_params["negative_prompt"] = negative_prompt
-                    
-                    response = client.images.generate(**generation_params)
-                    
-                    if response.data:
-                        st.success(f"🎉 Generated {len(response.data)} image(s)!")
-                        
-                        # Create responsive grid
-                        cols = st.columns(2)  # Always use 2 columns for consistency
-                        
-                        for i, image_data in enumerate(response.data):
-                            col_idx = i % 2  # Alternate between columns
-                            
-                            with cols[col_idx]:
-                                with st.container():
-                                    st.markdown('<div class="generated-card">', unsafe_allow_html=True)
-                                    
-                                    try:
-                                        b64_data = None
-                                        if hasattr(image_data, 'b64_json') and image_data.b64_json:
-                                            b64_data = image_data.b64_json
-                                        elif hasattr(image_data, 'base64') and image_data.base64:
-                                            b64_data = image_data.base64
-                                        elif hasattr(image_data, 'data') and image_data.data:
-                                            b64_data = image_data.data
-                                        elif hasattr(image_data, 'url') and image_data.url:
-                                            st.image(image_data.url, caption=f"Generated Image {i+1}")
-                                        
-                                        if b64_data:
-                                            image_bytes = base64.b64decode(b64_data)
-                                            image = Image.open(BytesIO(image_bytes))
-                                            
-                                            # Display the image
-                                            st.image(
-                                                image,
-                                                caption=f"🎨 Variation {i+1}",
-                                                use_container_width=True
-                                            )
-                                            
-                                        else:
-                                            st.error("Unable to process image data")
-                                    
-                                    except Exception as img_error:
-                                        st.error(f"Error processing image: {str(img_error)}")
-                                    
-                                    st.markdown('</div>', unsafe_allow_html=True)
+            # With a latency budget, the sidebar picks model, steps and resolution
+            config = auto_config or {"model": image_model, "steps": steps, "width": width, "height": height}
+            generation_params = image_params(
+                prompt,
+                model=config["model"],
+                steps=config["steps"],
+                n=num_images,
+                width=config["width"],
+                height=config["height"],
+                negative_prompt=negative_prompt
+            )
+            client = get_client(api_key, session=session_id)
             
-            except Exception as e:
-                st.error(f"🚨 Image generation failed: {str(e)}")
-                if "api_key" in str(e).lower():
-                    st.info("Please verify your API key is correct")
-                elif "rate limit" in str(e).lower():
-                    st.info("You've hit the rate limit. Please wait before trying again.")
+            # Dispatch the quick preview first so it's on screen while the full render runs
+            preview = submit_preview(client, session_id, generation_params, use_image_cache) if progressive_preview else None
+            job = jobs.submit(
+                run_image_job,
+                generation_params,
+                session=session_id,
+                preview_id=preview.id if preview else None,
+                client=client,
+                parallel=parallel_requests,
+                use_cache=use_image_cache,
+                postprocess=postprocess
+            )
+            st.session_state.setdefault('image_jobs', []).insert(0, job.id)
+        
+        if run_sweep_btn and cells:
+            job = jobs.submit(
+                run_sweep_job,
+                {"prompt": f"Sweep of {len(cells)} image(s)", "n": len(cells), "cells": cells},
+                session=session_id,
+                kind="sweep",
+                client=get_client(api_key, session=session_id),
+                parallel=parallel_requests,
+                use_cache=use_image_cache
+            )
+            st.session_state.setdefault('image_jobs', []).insert(0, job.id)
+        
+        # Jobs keep running across reruns; this panel polls them while any are active
+        session_jobs = [job for job in map(jobs.get, st.session_state.get('image_jobs', [])) if job]
+        polling = any(job.active for job in session_jobs)
+        st.fragment(show_jobs, run_every=JOB_POLL_SECONDS if polling else None)(polling)
+
+# History tab: pages through saved generations using thumbnails only
+with tab_history:
+    st.header("🗂️ History")
+    
+    viewing = st.session_state.get('history_view')
+    if viewing:
+        entry = history.get(viewing, owner=owner) if owner else None
+        if entry:
+            st.markdown(f'<div class="generated-card compact">{entry["prompt"]}</div>', unsafe_allow_html=True)
+            for image in entry["images"]:
+                data = history.blob(image["sha"]) if image["sha"] else image["url"]
+                if data:
+                    st.image(data, use_container_width=True, output_format=output_format(data) if image["sha"] else "auto")
+            st.json(entry["params"], expanded=False)
+        if st.button("⬅️ Back to gallery"):
+            st.session_state.history_view = None
+            st.rerun()
+    
+    elif not owner:
+        st.info("Enter your API key to see your saved generations.")
+    
+    else:
+        total = history.count(owner=owner)
+        if not total:
+            st.info("Nothing here yet. Generated images are saved automatically.")
+        else:
+            page_count = (total + HISTORY_PAGE_SIZE - 1) // HISTORY_PAGE_SIZE
+            page = st.number_input(
+                f"Page (of {page_count})",
+                min_value=1,
+                max_value=page_count,
+                value=1,
+                key="history_page"
+            )
+            entries = history.page(offset=(page - 1) * HISTORY_PAGE_SIZE, limit=HISTORY_PAGE_SIZE, owner=owner)
+            
+            cols = st.columns(4)
+            for i, entry in enumerate(entries):
+                with cols[i % 4]:
+                    thumbs = [history.thumbnail(image["sha"]) for image in entry["images"] if image["sha"]]
+                    thumbs = [thumb for thumb in thumbs if thumb]
+                    if thumbs:
+                        st.image(thumbs, width=100)
+                    st.caption(entry["prompt"][:80] + ("…" if len(entry["prompt"]) > 80 else ""))
+                    if st.button("🔍 Open", key=f"history_open_{entry['id']}"):
+                        st.session_state.history_view = entry["id"]
+                        st.rerun()
+        
+        with st.expander("📝 Recent Text & Prompts"):
+            for kind in ("prompt", "text"):
+                for entry in history.page(kind=kind, limit=5, owner=owner):
+                    st.markdown(f"**{entry['prompt'][:80]}**")
+                    st.markdown(f'<div class="generated-card compact">{entry["output"]}</div>', unsafe_allow_html=True)
 
 # FIXED: Guide tab content with proper markdown rendering
 with tab2:
@@ -622,6 +952,11 @@ with tab2:
     - **Negative Prompts:** Remove unwanted elements like "blurry, distorted, extra limbs"
     """)
 
+# Usage panel, drawn last so it includes this run's requests; it refreshes while images are generating
+with usage_panel:
+    jobs_active = any(job.active for job in map(jobs.get, st.session_state.get('image_jobs', [])) if job)
+    st.fragment(show_usage, run_every=JOB_POLL_SECONDS if jobs_active else None)(api_key, session_id)
+
 # Footer
 st.markdown("""
 <div class="footer">
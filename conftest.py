@@ -0,0 +1,8 @@
+"""Makes ``nexus`` importable under plain ``pytest`` (this directory goes on sys.path)."""
+
+import os
+import tempfile
+
+# Settings are read at import time; keep the module-level stores out of the checkout
+os.environ.setdefault("NEXUS_DATA_DIR", tempfile.mkdtemp(prefix="nexus-test-"))
+os.environ.setdefault("NEXUS_POSTPROCESS_WORKERS", "0")
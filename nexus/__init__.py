@@ -0,0 +1 @@
+# Shared building blocks for NexusAI Studio (app.py and the command-line tools)
@@ -0,0 +1,205 @@
+"""Headless batch generation.
+
+Reads prompts from a JSONL or CSV file and renders them with the same calls
+the Streamlit app makes::
+
+    python -m nexus.batch prompts.jsonl --out renders/ --workers 4
+
+Each row needs a ``prompt`` (or an ``idea`` to expand into one first) and may
+override ``id``, ``model``, ``steps``, ``n``, ``width``, ``height`` and
+``negative_prompt``. Images are written to ``<out>/images`` and one line per
+finished row is appended to ``<out>/manifest.jsonl``; rerunning the same
+command skips every row the manifest already lists as done.
+
+``--postprocess "upscale:2,watermark:NexusAI" --format webp`` also writes a
+post-processed copy of every image next to the original.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from nexus.clients import get_client
+from nexus.generation import (
+    DEFAULT_IMAGE_MODEL,
+    DEFAULT_TEXT_MODEL,
+    expand_prompt,
+    generate_images,
+    image_params,
+    sniff_format,
+)
+from nexus.image_cache import cache_key, image_cache
+from nexus.postprocess import EXTENSIONS, OUTPUT_FORMATS, parse_pipeline, postprocessor
+from nexus.scheduler import Scheduler
+
+INT_FIELDS = ("steps", "n", "width", "height")
+
+
+def read_rows(path):
+    path = Path(path)
+    with path.open(newline="", encoding="utf-8") as f:
+        if path.suffix.lower() == ".csv":
+            rows = [dict(row) for row in csv.DictReader(f)]
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    # Blank cells (CSV) and nulls mean "use the default", so drop them before defaults apply
+    rows = [{k: v for k, v in row.items() if v not in (None, "")} for row in rows]
+    for row in rows:
+        for field in INT_FIELDS:
+            if field in row:
+                row[field] = int(row[field])
+    return rows
+
+
+def row_id(row, defaults):
+    if row.get("id"):
+        return str(row["id"])
+    identity = {k: row.get(k, defaults.get(k)) for k in ("prompt", "idea", "model", "text_model", "negative_prompt", *INT_FIELDS)}
+    return cache_key(identity)[:16]
+
+
+def load_manifest(path):
+    done = set()
+    if path.exists():
+        with path.open(encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by a crash
+                if entry.get("status") == "ok":
+                    done.add(entry["id"])
+    return done
+
+
+def process(row, rid, args, client, images_dir):
+    started = time.perf_counter()
+    prompt = row.get("prompt")
+    if not prompt:
+        prompt = expand_prompt(client, row.get("text_model", args.text_model), row["idea"])
+
+    params = image_params(
+        prompt,
+        model=row.get("model", args.model),
+        steps=row.get("steps", args.steps),
+        n=row.get("n", args.n),
+        width=row.get("width", args.width),
+        height=row.get("height", args.height),
+        negative_prompt=row.get("negative_prompt", ""),
+    )
+
+    results = None if args.no_cache else image_cache.get(params)
+    if results is None:
+        results = generate_images(client, params)
+        if all(isinstance(result, bytes) for result in results):
+            image_cache.put(params, results)
+
+    files, urls, pending = [], [], []
+    for i, result in enumerate(results):
+        if isinstance(result, bytes):
+            name = f"{rid}_{i}.{sniff_format(result) or 'img'}"
+            (images_dir / name).write_bytes(result)
+            files.append(f"images/{name}")
+            if args.pipeline is not None:
+                pending.append((i, postprocessor.submit(result, args.pipeline, args.format, args.quality)))
+        elif result:
+            urls.append(result)
+
+    entry = {
+        "id": rid,
+        "status": "ok",
+        "prompt": prompt,
+        "params": params,
+        "files": files,
+        "urls": urls,
+    }
+    if pending:
+        entry["processed"] = []
+        entry["postprocess_seconds"] = {}
+        for i, future in pending:
+            data, timings = future.result()
+            name = f"{rid}_{i}.post.{EXTENSIONS[args.format]}"
+            (images_dir / name).write_bytes(data)
+            entry["processed"].append(f"images/{name}")
+            for stage, seconds in timings:
+                entry["postprocess_seconds"][stage] = round(entry["postprocess_seconds"].get(stage, 0) + seconds, 3)
+    entry["seconds"] = round(time.perf_counter() - started, 3)
+    return entry
+
+
+def run(args):
+    api_key = args.api_key or os.environ.get("TOGETHER_API_KEY")
+    if not api_key:
+        raise SystemExit("Set TOGETHER_API_KEY or pass --api-key")
+
+    out = Path(args.out)
+    images_dir = out / "images"
+    images_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = out / "manifest.jsonl"
+
+    done = load_manifest(manifest_path)
+    pending = []
+    for row in read_rows(args.input):
+        rid = row_id(row, vars(args))
+        if rid not in done:
+            pending.append((rid, row))
+            done.add(rid)  # duplicate rows in the input render once
+    print(f"{len(pending)} to render, {len(done) - len(pending)} already in manifest", file=sys.stderr)
+
+    # Own scheduler so --rate applies to this run rather than the app defaults
+    client = get_client(api_key, scheduler=Scheduler(rate=args.rate, burst=max(1, args.workers)))
+    failed = 0
+    write_lock = threading.Lock()
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor, \
+            manifest_path.open("a", encoding="utf-8") as manifest:
+        futures = {
+            executor.submit(process, row, rid, args, client, images_dir): rid
+            for rid, row in pending
+        }
+        for future in as_completed(futures):
+            rid = futures[future]
+            try:
+                entry = future.result()
+            except Exception as e:
+                failed += 1
+                entry = {"id": rid, "status": "error", "error": str(e)}
+            with write_lock:
+                manifest.write(json.dumps(entry) + "\n")
+                manifest.flush()
+            print(f"[{entry['status']}] {rid}", file=sys.stderr)
+
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render a file of prompts without the UI")
+    parser.add_argument("input", help="JSONL or CSV file of prompts")
+    parser.add_argument("--out", default="batch-output", help="Output directory (default: %(default)s)")
+    parser.add_argument("--api-key", help="Together AI API key (default: $TOGETHER_API_KEY)")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent rows (default: %(default)s)")
+    parser.add_argument("--rate", type=float, default=2.0, help="Max requests started per second (default: %(default)s)")
+    parser.add_argument("--model", default=DEFAULT_IMAGE_MODEL)
+    parser.add_argument("--text-model", default=DEFAULT_TEXT_MODEL)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--n", type=int, default=1)
+    parser.add_argument("--width", type=int, default=1024)
+    parser.add_argument("--height", type=int, default=1024)
+    parser.add_argument("--no-cache", action="store_true", help="Always call the API, ignoring the local image cache")
+    parser.add_argument("--postprocess", help='Post-processing stages, e.g. "upscale:2,levels,watermark:NexusAI,thumbnail:1024"')
+    parser.add_argument("--format", default="WEBP", type=str.upper, choices=OUTPUT_FORMATS,
+                        help="Format of post-processed copies (default: %(default)s)")
+    parser.add_argument("--quality", type=int, default=80, help="Encoder quality of post-processed copies (default: %(default)s)")
+    args = parser.parse_args(argv)
+    args.pipeline = parse_pipeline(args.postprocess) if args.postprocess else None
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
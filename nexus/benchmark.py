@@ -0,0 +1,177 @@
+"""Offline benchmark of the app's generation paths against FakeTogether.
+
+    python -m nexus.benchmark --iterations 20 --concurrency 4
+    python -m nexus.benchmark --scenario image --json bench.json
+
+Each scenario runs the same code the app runs (scheduled client, generation
+helpers, image cache, previews). It reports throughput, p50/p95/p99
+latency and RSS. Latency knobs default to zero so the numbers measure our
+own overhead; pass --image-latency etc. to model the provider too.
+"""
+
+import argparse
+import json
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from nexus.clients import ClientRegistry
+from nexus.fake_together import FakeTogether
+from nexus.generation import (
+    expand_prompt,
+    generate_images,
+    generate_text,
+    image_params,
+    iter_images,
+    stream_completion,
+    text_messages,
+)
+from nexus.image_cache import ImageCache
+from nexus.previews import make_preview
+from nexus.scheduler import ScheduledClient, Scheduler
+
+SIZES = (512, 768, 1024)
+IMAGE_COUNTS = (1, 2, 3, 4)
+PROMPT = "A futuristic cyberpunk cityscape at night, neon lights reflecting on wet streets"
+
+
+def rss_mb():
+    """Current resident set size in MiB (Linux), falling back to the peak."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 2 ** 20
+    except OSError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(name, fn, iterations, concurrency, warmup=1):
+    latencies = []
+    errors = 0
+    for _ in range(warmup):
+        try:
+            fn()  # fills canned payloads and lazy imports outside the timed runs
+        except Exception:
+            pass
+
+    def one(_):
+        started = time.perf_counter()
+        try:
+            fn()
+        except Exception:
+            return None
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for latency in executor.map(one, range(iterations)):
+            if latency is None:
+                errors += 1
+            else:
+                latencies.append(latency)
+    wall = time.perf_counter() - started
+
+    return {
+        "scenario": name,
+        "iterations": iterations,
+        "errors": errors,
+        "throughput": len(latencies) / wall if wall else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "rss_mb": rss_mb(),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def scenarios(args, client, cache):
+    if "prompt" in args.scenario:
+        yield "prompt", lambda: expand_prompt(client, "fake/text", "a futuristic city")
+    if "text" in args.scenario:
+        yield "text", lambda: generate_text(client, "fake/text", PROMPT)
+        yield "text-stream", lambda: "".join(
+            stream_completion(client, model="fake/text", messages=text_messages(PROMPT), max_tokens=1024)
+        )
+    if "image" in args.scenario:
+        for width in SIZES:
+            for height in SIZES:
+                for n in IMAGE_COUNTS:
+                    params = image_params(PROMPT, model="fake/image", steps=args.steps, n=n,
+                                          width=width, height=height)
+                    yield (f"image {width}x{height} n={n}",
+                           lambda p=params: [make_preview(d) for _, d in iter_images(client, p, args.parallel)])
+    if "cache" in args.scenario:
+        params = image_params(PROMPT, model="fake/image", steps=args.steps, n=4)
+        cache.put(params, generate_images(client, params, args.parallel))
+        yield "image-cache-hit", lambda: cache.get(params)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark generation paths against a fake provider")
+    parser.add_argument("--scenario", nargs="+", default=["prompt", "text", "image", "cache"],
+                        choices=["prompt", "text", "image", "cache"])
+    parser.add_argument("--iterations", type=int, default=10, help="Calls per scenario (default: %(default)s)")
+    parser.add_argument("--concurrency", type=int, default=1, help="Concurrent callers (default: %(default)s)")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed calls before each scenario (default: %(default)s)")
+    parser.add_argument("--parallel", type=int, default=4, help="Per-request image fan-out (default: %(default)s)")
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--text-latency", type=float, default=0.0)
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    parser.add_argument("--image-latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args(argv)
+
+    fake = FakeTogether(
+        text_latency=args.text_latency,
+        token_latency=args.token_latency,
+        image_latency=args.image_latency,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    registry = ClientRegistry(factory=lambda _: fake)
+    # Generous limits: measure our own overhead, not the throttle (retries still apply)
+    scheduler = Scheduler(rate=1e6, burst=10 ** 6, base_delay=0.001, max_delay=0.01)
+    client = ScheduledClient(registry.get("bench"), scheduler, "bench")
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ImageCache(directory=Path(tmp), memory_entries=0)
+        print(f"{'scenario':<24}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'err':>6}{'rss MB':>9}")
+        for name, fn in scenarios(args, client, cache):
+            result = measure(name, fn, args.iterations, args.concurrency, args.warmup)
+            results.append(result)
+            print(f"{name:<24}{result['throughput']:>10.1f}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}"
+                  f"{result['p99_ms']:>10.1f}{result['errors']:>6}{result['rss_mb']:>9.1f}")
+
+    summary = {
+        "args": vars(args),
+        "results": results,
+        "peak_rss_mb": peak_rss_mb(),
+        "scheduler": scheduler.stats(),
+        "provider_calls": fake.calls,
+    }
+    print(f"peak RSS {summary['peak_rss_mb']:.1f} MB, provider calls {fake.calls}, retries {scheduler.retried}")
+    if args.json:
+        Path(args.json).write_text(json.dumps(summary, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
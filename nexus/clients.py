@@ -0,0 +1,96 @@
+import hashlib
+import threading
+import time
+
+from nexus.config import env_float, env_int
+from nexus.lru import LRUCache
+from nexus.metrics import metrics
+
+# Idle clients are dropped after this many seconds; the registry never holds
+# more than MAX_CLIENTS connection pools at once.
+CLIENT_IDLE_TTL = env_float("NEXUS_CLIENT_IDLE_TTL", 15 * 60)
+MAX_CLIENTS = env_int("NEXUS_MAX_CLIENTS", 32)
+
+
+def key_fingerprint(api_key):
+    """Stable, non-reversible identifier for an API key (safe to log or use as a dict key)."""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+def _close(_, client):
+    close = getattr(client, "close", None)
+    if close:
+        try:
+            close()
+        except Exception:
+            pass
+
+
+class ClientRegistry:
+    """Process-wide pool of Together clients, one per API key.
+
+    Reusing a client keeps its HTTP connection pool (and TLS sessions) alive
+    between Streamlit reruns instead of reconnecting on every button press.
+    Evicted clients are only dropped, not closed: a running job may still be
+    using one, and its pool is released once the last reference goes away.
+    """
+
+    def __init__(self, factory=None, max_clients=MAX_CLIENTS, idle_ttl=CLIENT_IDLE_TTL, clock=time.monotonic):
+        self._factory = factory
+        self._clients = LRUCache(max_clients, ttl=idle_ttl, sliding=True, clock=clock)
+        self._lock = threading.Lock()
+        self._clock = clock
+        # Idle keys are swept from ``get``, at most this often
+        self._sweep_interval = min(60.0, idle_ttl)
+        self._next_sweep = clock() + self._sweep_interval
+
+    def _create(self, api_key):
+        if self._factory is not None:
+            return self._factory(api_key)
+        from together import Together
+        # Retries are handled by nexus.scheduler, which also honors Retry-After
+        return Together(api_key=api_key, max_retries=0)
+
+    def get(self, api_key):
+        if self._clock() >= self._next_sweep:
+            self._next_sweep = self._clock() + self._sweep_interval
+            self.evict_idle()
+        fingerprint = key_fingerprint(api_key)
+        client = self._clients.get(fingerprint)
+        if client is None:
+            with self._lock:
+                # Another session may have created it while we waited
+                client = self._clients.pop(fingerprint) or self._create(api_key)
+                self._clients.put(fingerprint, client)
+        return client
+
+    def evict_idle(self):
+        return self._clients.expire()
+
+    def close_all(self):
+        clients = self._clients.values()
+        self._clients.clear()
+        for client in clients:
+            _close(None, client)
+
+    def stats(self):
+        return self._clients.stats()
+
+
+registry = ClientRegistry()
+metrics.register("clients", registry.stats)
+
+
+def get_client(api_key, session=None, scheduler=None):
+    """Client for ``api_key`` whose calls are rate limited and retried.
+
+    ``session`` identifies the caller for fair queueing between sessions
+    sharing a key; ``scheduler`` defaults to the process-wide one.
+    """
+    from nexus import scheduler as scheduling
+    return scheduling.ScheduledClient(
+        registry.get(api_key),
+        scheduler or scheduling.scheduler,
+        key_fingerprint(api_key),
+        session=session,
+    )
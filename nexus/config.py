@@ -0,0 +1,15 @@
+import os
+from pathlib import Path
+
+# Everything the app persists (caches, history, job results) lives under here
+DATA_DIR = Path(os.environ.get("NEXUS_DATA_DIR", ".nexus"))
+
+
+def env_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value not in (None, "") else default
+
+
+def env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, "") else default
@@ -0,0 +1,107 @@
+"""Offline stand-in for the Together client.
+
+Implements the small part of the SDK the app uses (``chat.completions.create``
+with and without streaming, ``images.generate``). Responses are canned, with
+configurable latency and error rate, so benchmarks and load tests cost no
+credits and need no network.
+"""
+
+import base64
+import random
+import threading
+import time
+from io import BytesIO
+from types import SimpleNamespace
+
+CANNED_TEXT = (
+    "A sweeping futuristic cityscape at dusk, neon signs reflecting on rain-soaked streets, "
+    "towering glass megastructures wrapped in holographic billboards, flying vehicles tracing "
+    "light trails, cinematic volumetric fog, ultra-detailed, 8K, Unreal Engine 5 render"
+)
+
+
+class FakeAPIError(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers={})
+
+
+_payloads = {}
+_payloads_lock = threading.Lock()
+
+
+def canned_image(width, height, fmt="JPEG"):
+    """Base64 of a noisy width x height image (generated once per size, then reused)."""
+    key = (width, height, fmt)
+    with _payloads_lock:
+        if key not in _payloads:
+            from PIL import Image
+
+            # Noise keeps the encoded size close to a real render's
+            noise = Image.effect_noise((width, height), 64).convert("RGB")
+            buffer = BytesIO()
+            noise.save(buffer, format=fmt, quality=90)
+            _payloads[key] = base64.b64encode(buffer.getvalue()).decode("ascii")
+        return _payloads[key]
+
+
+class FakeTogether:
+    """Drop-in for ``together.Together`` with simulated latency and failures.
+
+    ``image_latency`` is seconds per 1024x1024 image at 20 steps and scales
+    with pixels x steps; ``error_rate`` is the chance any call raises a 429
+    or 503 before doing anything.
+    """
+
+    def __init__(self, api_key=None, text_latency=0.2, token_latency=0.005, image_latency=1.0,
+                 error_rate=0.0, jitter=0.1, seed=None, **_):
+        self.api_key = api_key
+        self.text_latency = text_latency
+        self.token_latency = token_latency
+        self.image_latency = image_latency
+        self.error_rate = error_rate
+        self.jitter = jitter
+        self.calls = {"chat": 0, "images": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat))
+        self.images = SimpleNamespace(generate=self._generate)
+
+    def _sleep(self, seconds):
+        with self._lock:
+            factor = 1 + self._random.uniform(-self.jitter, self.jitter)
+            fail = self._random.random() < self.error_rate
+            status = self._random.choice((429, 503))
+        if fail:
+            raise FakeAPIError(status, "Simulated rate limit" if status == 429 else "Simulated outage")
+        time.sleep(max(0.0, seconds * factor))
+
+    def _chat(self, model=None, messages=None, stream=False, max_tokens=None, **_):
+        with self._lock:
+            self.calls["chat"] += 1
+        tokens = CANNED_TEXT.split(" ")
+        if max_tokens:
+            tokens = tokens[:max_tokens]
+        self._sleep(self.text_latency)
+        if stream:
+            return self._stream(tokens)
+        message = SimpleNamespace(content=" ".join(tokens), role="assistant")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], model=model)
+
+    def _stream(self, tokens):
+        for i, token in enumerate(tokens):
+            time.sleep(self.token_latency)
+            delta = SimpleNamespace(content=token if i == 0 else " " + token)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+    def _generate(self, prompt=None, model=None, steps=20, n=1, width=1024, height=1024, **_):
+        with self._lock:
+            self.calls["images"] += 1
+        self._sleep(self.image_latency * (width * height) / (1024 * 1024) * steps / 20)
+        payload = canned_image(width, height)
+        data = [SimpleNamespace(b64_json=payload, index=i, type="b64_json") for i in range(n)]
+        return SimpleNamespace(data=data, model=model)
+
+    def close(self):
+        pass
@@ -0,0 +1,176 @@
+"""Server-side download of URL image results.
+
+When the provider answers with a URL instead of base64, the image is
+fetched here, so it can be cached, saved to history and post-processed like
+any other result. Downloads share one keep-alive connection pool, stream to
+disk in chunks while being hashed, and are stored once per checksum. Any
+failure (timeout, HTTP error, not an image, too large) hands back the
+original URL, which the browser can still load itself.
+"""
+
+import hashlib
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from nexus.config import DATA_DIR, env_float, env_int
+from nexus.lru import LRUCache
+from nexus.metrics import SIZE_BUCKETS, inc, metrics, observe, timed
+
+DOWNLOAD_DIR = DATA_DIR / "downloads"
+FETCH_URLS = os.environ.get("NEXUS_FETCH_URLS", "1") == "1"
+FETCH_POOL_SIZE = env_int("NEXUS_FETCH_POOL_SIZE", 8)
+FETCH_CONNECT_TIMEOUT = env_float("NEXUS_FETCH_CONNECT_TIMEOUT", 5)
+FETCH_READ_TIMEOUT = env_float("NEXUS_FETCH_READ_TIMEOUT", 30)
+FETCH_MAX_BYTES = env_int("NEXUS_FETCH_MAX_MB", 50) * 1024 * 1024
+DOWNLOAD_CACHE_BYTES = env_int("NEXUS_DOWNLOAD_CACHE_MB", 256) * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+class FetchError(Exception):
+    pass
+
+
+class Fetcher:
+    def __init__(self, directory=DOWNLOAD_DIR, pool_size=FETCH_POOL_SIZE,
+                 timeout=(FETCH_CONNECT_TIMEOUT, FETCH_READ_TIMEOUT), max_bytes=FETCH_MAX_BYTES,
+                 cache_bytes=DOWNLOAD_CACHE_BYTES, session_factory=None):
+        self.directory = directory
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.cache_bytes = cache_bytes
+        self.downloads = 0
+        self.deduplicated = 0
+        self.failures = 0
+        self._session_factory = session_factory
+        self._session = None
+        self._urls = LRUCache(1024)  # url -> checksum, so a repeated URL isn't fetched again
+        self._lock = threading.Lock()
+        self._disk_bytes = None
+
+    def _get_session(self):
+        with self._lock:
+            if self._session is None:
+                if self._session_factory is not None:
+                    self._session = self._session_factory()
+                else:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+            return self._session
+
+    def _path(self, sha):
+        return self.directory / sha[:2] / sha
+
+    def _download(self, url):
+        """Stream ``url`` to a temp file while hashing it; returns (checksum, bytes)."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = self.directory / f".{uuid.uuid4().hex}.part"
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with self._get_session().get(url, stream=True, timeout=self.timeout) as response:
+                response.raise_for_status()
+                content_type = response.headers.get("Content-Type", "")
+                if content_type and not content_type.startswith(("image/", "application/octet-stream")):
+                    raise FetchError(f"Not an image: {content_type}")
+                with tmp.open("wb") as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > self.max_bytes:
+                            raise FetchError(f"Larger than {self.max_bytes} bytes")
+                        digest.update(chunk)
+                        f.write(chunk)
+            if not size:
+                raise FetchError("Empty response")
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+
+        sha = digest.hexdigest()
+        path = self._path(sha)
+        # Read before eviction runs: a budget smaller than this file would delete it straight away
+        data = tmp.read_bytes()
+        with self._lock:
+            if path.exists():
+                tmp.unlink()  # same bytes already on disk
+                self.deduplicated += 1
+            else:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp, path)
+                if self._disk_bytes is not None:
+                    self._disk_bytes += size
+                self._enforce_limit()
+        observe("payload_bytes", size, buckets=SIZE_BUCKETS, kind="download")
+        return sha, data
+
+    def _enforce_limit(self):
+        if self._disk_bytes is None:
+            self._disk_bytes = sum(f.stat().st_size for f in self.directory.glob("??/*"))
+        if self._disk_bytes <= self.cache_bytes:
+            return
+        for f in sorted(self.directory.glob("??/*"), key=lambda f: f.stat().st_mtime):
+            if self._disk_bytes <= self.cache_bytes:
+                break
+            self._disk_bytes -= f.stat().st_size
+            f.unlink(missing_ok=True)
+
+    def fetch(self, url):
+        """Image bytes for ``url``, or ``url`` itself if it couldn't be downloaded."""
+        sha = self._urls.get(url)
+        if sha is not None:
+            try:
+                return self._path(sha).read_bytes()
+            except OSError:
+                pass  # evicted since: download it again
+        try:
+            with timed("download"):
+                sha, data = self._download(url)
+        except Exception:
+            self.failures += 1
+            inc("download_errors")
+            return url
+        self.downloads += 1
+        self._urls.put(url, sha)
+        return data
+
+    def fetch_all(self, urls):
+        """``fetch`` every URL concurrently, preserving order."""
+        if len(urls) <= 1:
+            return [self.fetch(url) for url in urls]
+        with ThreadPoolExecutor(max_workers=min(self.pool_size, len(urls))) as executor:
+            return list(executor.map(self.fetch, urls))
+
+    def stats(self):
+        return {
+            "downloads": self.downloads,
+            "deduplicated": self.deduplicated,
+            "failures": self.failures,
+            "disk_bytes": self._disk_bytes or 0,
+        }
+
+
+fetcher = Fetcher()
+metrics.register("fetcher", fetcher.stats)
+
+
+def resolve(result):
+    """Turn a URL result into bytes when URL fetching is on; anything else passes through."""
+    if FETCH_URLS and isinstance(result, str):
+        return fetcher.fetch(result)
+    return result
+
+
+def resolve_all(results):
+    urls = [result for result in results if isinstance(result, str)]
+    if not FETCH_URLS or not urls:
+        return results
+    fetched = iter(fetcher.fetch_all(urls))
+    return [next(fetched) if isinstance(result, str) else result for result in results]
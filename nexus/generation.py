@@ -0,0 +1,202 @@
+import base64
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from nexus.fetch import resolve, resolve_all
+from nexus.latency import latency_model
+from nexus.metrics import SIZE_BUCKETS, observe, timed
+
+PROMPT_ENGINEER_SYSTEM = (
+    "You are a professional prompt engineer for AI image generation. Create a detailed, "
+    "creative prompt based on the user's simple idea. Include style, composition, lighting, "
+    "and artistic details. Respond with just the prompt text, no additional commentary."
+)
+
+DEFAULT_TEXT_MODEL = "deepseek-ai/DeepSeek-V3"
+DEFAULT_IMAGE_MODEL = "black-forest-labs/FLUX.1-dev"
+# How often a parallel batch checks whether it was cancelled
+CANCEL_POLL_SECONDS = 0.2
+
+# Magic numbers of the formats browsers can display as-is
+IMAGE_SIGNATURES = {
+    b"\x89PNG\r\n\x1a\n": "png",
+    b"\xff\xd8\xff": "jpeg",
+    b"GIF87a": "gif",
+    b"GIF89a": "gif",
+}
+
+
+def prompt_messages(idea):
+    return [
+        {"role": "system", "content": PROMPT_ENGINEER_SYSTEM},
+        {"role": "user", "content": f"Create a professional AI image generation prompt for: {idea}"},
+    ]
+
+
+def text_messages(prompt):
+    return [{"role": "user", "content": prompt}]
+
+
+def expand_prompt(client, model, idea):
+    """Turn a short idea into a detailed image prompt."""
+    with timed("prompt", model=model):
+        response = client.chat.completions.create(model=model, messages=prompt_messages(idea))
+    text = response.choices[0].message.content
+    observe("payload_bytes", len(text.encode("utf-8")), buckets=SIZE_BUCKETS, kind="prompt")
+    return text
+
+
+def generate_text(client, model, prompt, max_tokens=1024):
+    with timed("text", model=model):
+        response = client.chat.completions.create(
+            model=model,
+            messages=text_messages(prompt),
+            max_tokens=max_tokens,
+        )
+    text = response.choices[0].message.content
+    observe("payload_bytes", len(text.encode("utf-8")), buckets=SIZE_BUCKETS, kind="text")
+    return text
+
+
+def stream_completion(client, stage="text", **request):
+    """Yield the text deltas of a streamed chat completion.
+
+    Records time to first token and total time under ``stage``.
+    """
+    model = request.get("model")
+    started = time.perf_counter()
+    first = None
+    size = 0
+    for chunk in client.chat.completions.create(stream=True, **request):
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if delta:
+            if first is None:
+                first = time.perf_counter() - started
+                observe("first_token_seconds", first, stage=stage, model=model)
+            size += len(delta.encode("utf-8"))
+            yield delta
+    observe("stage_seconds", time.perf_counter() - started, stage=stage, model=model)
+    observe("payload_bytes", size, buckets=SIZE_BUCKETS, kind=stage)
+
+
+def image_params(prompt, model=DEFAULT_IMAGE_MODEL, steps=20, n=1, width=1024, height=1024,
+                 negative_prompt=""):
+    """Build the ``images.generate`` arguments exactly as the app sends them."""
+    params = {
+        "prompt": prompt,
+        "model": model,
+        "steps": steps,
+        "n": n,
+        "width": width,
+        "height": height,
+    }
+    if negative_prompt and negative_prompt.strip():
+        params["negative_prompt"] = negative_prompt
+    return params
+
+
+def extract_image(image_data):
+    """Return decoded bytes for base64 results, the URL for URL results, or None."""
+    b64_data = None
+    if getattr(image_data, "b64_json", None):
+        b64_data = image_data.b64_json
+    elif getattr(image_data, "base64", None):
+        b64_data = image_data.base64
+    elif getattr(image_data, "data", None):
+        b64_data = image_data.data
+    elif getattr(image_data, "url", None):
+        return image_data.url
+
+    if b64_data:
+        with timed("decode"):
+            data = base64.b64decode(b64_data)
+        observe("payload_bytes", len(data), buckets=SIZE_BUCKETS, kind="image")
+        return data
+    return None
+
+
+def sniff_format(data):
+    """Image format of encoded bytes ("png", "jpeg", "gif", "webp"), or None."""
+    for signature, fmt in IMAGE_SIGNATURES.items():
+        if data.startswith(signature):
+            return fmt
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def image_labels(params):
+    return {
+        "model": params.get("model"),
+        "steps": params.get("steps"),
+        "resolution": f"{params.get('width')}x{params.get('height')}",
+        "n": params.get("n", 1),
+    }
+
+
+def _generate(client, params):
+    started = time.perf_counter()
+    with timed("image", **image_labels(params)):
+        response = client.images.generate(**params)
+    latency_model.record(params, time.perf_counter() - started)
+    return response
+
+
+def _generate_one(client, params):
+    """One ``n=1`` request, with a URL result already downloaded."""
+    return resolve(extract_image(_generate(client, params).data[0]))
+
+
+def iter_images(client, params, parallel=1, cancelled=None):
+    """Generate images, yielding ``(index, result)`` pairs as they complete.
+
+    With ``parallel > 1`` and more than one image requested, the batch is
+    split into ``n=1`` requests run on a bounded thread pool. A failed
+    request yields its exception as the result instead of raising, so the
+    remaining images still come through. URL results are downloaded (see
+    ``nexus.fetch``) and only stay URLs if the download fails.
+
+    Once ``cancelled()`` turns true, or the generator is closed, requests
+    that haven't been sent yet are dropped. Requests already sent are paid
+    for either way, so after ``cancelled()`` their images are still yielded.
+    """
+    n = params.get("n", 1)
+    if n <= 1 or parallel <= 1:
+        data = _generate(client, params).data or []
+        results = []
+        for i in range(len(data)):
+            # Drop each base64 payload as soon as it's decoded
+            image_data, data[i] = data[i], None
+            results.append(extract_image(image_data))
+        # URL results are downloaded together, over the shared connection pool
+        yield from enumerate(resolve_all(results))
+        return
+
+    single_params = dict(params, n=1)
+    executor = ThreadPoolExecutor(max_workers=min(parallel, n))
+    try:
+        futures = {executor.submit(_generate_one, client, single_params): i for i in range(n)}
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=CANCEL_POLL_SECONDS, return_when=FIRST_COMPLETED)
+            if cancelled is not None and cancelled():
+                # Drop the queued requests; the ones already running still arrive below
+                pending = {future for future in pending if not future.cancel()}
+            for future in done:
+                try:
+                    yield futures[future], future.result()
+                except Exception as e:
+                    yield futures[future], e
+    finally:
+        # Without waiting: a closed generator must not block on requests in progress
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def generate_images(client, params, parallel=1):
+    """Blocking variant of ``iter_images``: the results in order, raising the first failure."""
+    results = {}
+    for i, result in iter_images(client, params, parallel):
+        if isinstance(result, Exception):
+            raise result
+        results[i] = result
+    return [results[i] for i in sorted(results)]
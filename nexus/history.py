@@ -0,0 +1,236 @@
+"""Persistent generation history.
+
+Metadata (prompt, params, timings) lives in SQLite; image bytes live in a
+content-addressed blob directory, so identical images are stored once.
+A small JPEG thumbnail is written alongside each new blob, which lets the
+gallery page through thousands of entries without touching the originals.
+Each entry is stamped with the fingerprint of the API key that made it
+(``owner``), and the gallery only lists a key's own entries.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+from io import BytesIO
+
+from nexus.config import DATA_DIR, env_int
+from nexus.generation import sniff_format
+
+HISTORY_DIR = DATA_DIR / "history"
+THUMBNAIL_SIZE = env_int("NEXUS_THUMBNAIL_SIZE", 256)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS generations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created REAL NOT NULL,
+    kind TEXT NOT NULL,
+    session TEXT,
+    owner TEXT,
+    prompt TEXT NOT NULL,
+    params TEXT NOT NULL,
+    output TEXT,
+    seconds REAL
+);
+CREATE INDEX IF NOT EXISTS generations_kind_created ON generations (kind, created DESC);
+CREATE TABLE IF NOT EXISTS images (
+    generation_id INTEGER NOT NULL REFERENCES generations (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    sha TEXT,
+    url TEXT,
+    format TEXT,
+    width INTEGER,
+    height INTEGER,
+    size INTEGER,
+    PRIMARY KEY (generation_id, position)
+);
+CREATE INDEX IF NOT EXISTS images_sha ON images (sha);
+"""
+
+
+def image_size(data):
+    from PIL import Image
+
+    with Image.open(BytesIO(data)) as image:  # only parses the header
+        return image.size
+
+
+def make_thumbnail(data, size=THUMBNAIL_SIZE):
+    """Return (thumbnail JPEG bytes, original width, original height)."""
+    from PIL import Image
+
+    with Image.open(BytesIO(data)) as image:
+        width, height = image.size
+        image.draft("RGB", (size, size))
+        image.thumbnail((size, size))
+        buffer = BytesIO()
+        image.convert("RGB").save(buffer, format="JPEG", quality=80)
+    return buffer.getvalue(), width, height
+
+
+class HistoryStore:
+    def __init__(self, directory=HISTORY_DIR):
+        self.directory = directory
+        self._ready = False
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if not self._ready:
+            with self._lock:
+                if not self._ready:
+                    self.directory.mkdir(parents=True, exist_ok=True)
+                    with closing(sqlite3.connect(self.directory / "history.db")) as conn:
+                        conn.execute("PRAGMA journal_mode=WAL")
+                        conn.executescript(SCHEMA)
+                        columns = {row[1] for row in conn.execute("PRAGMA table_info(generations)")}
+                        if "owner" not in columns:  # databases from before entries had owners
+                            conn.execute("ALTER TABLE generations ADD COLUMN owner TEXT")
+                        conn.execute("CREATE INDEX IF NOT EXISTS generations_owner_kind_created"
+                                     " ON generations (owner, kind, created DESC)")
+                    self._ready = True
+        conn = sqlite3.connect(self.directory / "history.db", timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def _blob_path(self, sha):
+        return self.directory / "blobs" / sha[:2] / sha
+
+    def _thumb_path(self, sha):
+        return self.directory / "thumbs" / sha[:2] / f"{sha}.jpg"
+
+    @staticmethod
+    def _write_once(path, data):
+        """Write ``path`` atomically unless it exists. Concurrent writers of the same
+        content each use their own temp file, and whoever renames last wins."""
+        if path.exists():
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{uuid.uuid4().hex}.tmp")
+        try:
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    def _store_blob(self, data):
+        sha = hashlib.sha256(data).hexdigest()
+        width = height = None
+        self._write_once(self._blob_path(sha), data)
+        thumb = self._thumb_path(sha)
+        try:
+            if thumb.exists():
+                width, height = image_size(data)
+            else:
+                thumb_bytes, width, height = make_thumbnail(data)
+                self._write_once(thumb, thumb_bytes)
+        except Exception:
+            pass  # not an image Pillow can read; keep the blob anyway
+        return sha, width, height
+
+    def _insert(self, conn, kind, prompt, params, output=None, seconds=None, session=None, owner=None):
+        cursor = conn.execute(
+            "INSERT INTO generations (created, kind, session, owner, prompt, params, output, seconds)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (time.time(), kind, session, owner, prompt, json.dumps(params, sort_keys=True), output, seconds),
+        )
+        return cursor.lastrowid
+
+    def record_images(self, params, results, seconds=None, session=None, owner=None):
+        """Save an image generation; ``results`` are image bytes or URLs. Returns its id.
+
+        ``owner`` is the fingerprint of the API key that paid for it.
+        """
+        stored = []
+        for result in results:
+            if isinstance(result, bytes):
+                sha, width, height = self._store_blob(result)
+                stored.append((sha, None, sniff_format(result), width, height, len(result)))
+            elif result:
+                stored.append((None, result, None, None, None, None))
+
+        with closing(self._connect()) as conn, conn:
+            generation_id = self._insert(conn, "image", params.get("prompt", ""), params,
+                                         seconds=seconds, session=session, owner=owner)
+            conn.executemany(
+                "INSERT INTO images (generation_id, position, sha, url, format, width, height, size)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(generation_id, i, *row) for i, row in enumerate(stored)],
+            )
+        return generation_id
+
+    def record_text(self, kind, prompt, output, params=None, seconds=None, session=None, owner=None):
+        """Save a text or prompt generation. Returns its id."""
+        with closing(self._connect()) as conn, conn:
+            return self._insert(conn, kind, prompt, params or {}, output=output,
+                                seconds=seconds, session=session, owner=owner)
+
+    @staticmethod
+    def _where(kind, owner):
+        """WHERE clause and arguments for ``kind`` entries, only ``owner``'s unless it is None."""
+        if owner is None:
+            return "kind = ?", [kind]
+        return "kind = ? AND owner = ?", [kind, owner]
+
+    def count(self, kind="image", owner=None):
+        """Number of ``kind`` entries; ``owner`` (a key fingerprint) limits it to that key's."""
+        where, args = self._where(kind, owner)
+        with closing(self._connect()) as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM generations WHERE {where}", args).fetchone()[0]
+
+    def prompts(self, kind="image", after_id=0):
+        """(id, prompt, owner) of every entry newer than ``after_id``, oldest first."""
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "SELECT id, prompt, owner FROM generations WHERE kind = ? AND id > ? ORDER BY id",
+                (kind, after_id),
+            ).fetchall()
+
+    def _attach_images(self, conn, entries):
+        ids = [entry["id"] for entry in entries if entry["kind"] == "image"]
+        if not ids:
+            return entries
+        images = conn.execute(
+            f"SELECT * FROM images WHERE generation_id IN ({','.join('?' * len(ids))})"
+            " ORDER BY generation_id, position",
+            ids,
+        ).fetchall()
+        by_generation = {}
+        for image in images:
+            by_generation.setdefault(image["generation_id"], []).append(dict(image))
+        for entry in entries:
+            entry["images"] = by_generation.get(entry["id"], [])
+        return entries
+
+    def page(self, kind="image", offset=0, limit=12, owner=None):
+        """Newest-first entries as dicts; image entries carry an ``images`` list."""
+        where, args = self._where(kind, owner)
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                f"SELECT * FROM generations WHERE {where} ORDER BY created DESC, id DESC LIMIT ? OFFSET ?",
+                (*args, limit, offset),
+            ).fetchall()
+            return self._attach_images(conn, [dict(row, params=json.loads(row["params"])) for row in rows])
+
+    def get(self, generation_id, owner=None):
+        """The entry, or None if it doesn't exist (or, given ``owner``, belongs to another key)."""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM generations WHERE id = ?", (generation_id,)).fetchone()
+            if row is None or (owner is not None and row["owner"] != owner):
+                return None
+            return self._attach_images(conn, [dict(row, params=json.loads(row["params"]))])[0]
+
+    def thumbnail(self, sha):
+        path = self._thumb_path(sha)
+        return path.read_bytes() if path.exists() else None
+
+    def blob(self, sha):
+        path = self._blob_path(sha)
+        return path.read_bytes() if path.exists() else None
+
+
+history = HistoryStore()
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from nexus.config import DATA_DIR, env_float, env_int
+from nexus.lru import LRUCache
+from nexus.metrics import metrics
+
+IMAGE_CACHE_DIR = DATA_DIR / "image-cache"
+IMAGE_CACHE_MAX_BYTES = env_int("NEXUS_IMAGE_CACHE_MB", 512) * 1024 * 1024
+IMAGE_CACHE_TTL = env_float("NEXUS_IMAGE_CACHE_TTL", 7 * 24 * 3600)
+IMAGE_CACHE_MEMORY_ENTRIES = env_int("NEXUS_IMAGE_CACHE_MEMORY_ENTRIES", 32)
+IMAGE_CACHE_MEMORY_BYTES = env_int("NEXUS_IMAGE_CACHE_MEMORY_MB", 128) * 1024 * 1024
+
+
+def cache_key(params):
+    """Canonical hash of a generation request; key order and whitespace don't matter."""
+    canonical = json.dumps(params, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ImageCache:
+    """Two-tier cache of decoded image bytes keyed on ``cache_key(params)``.
+
+    The memory tier is a small LRU in front of a directory with one folder per
+    entry. A folder's mtime records its last use and drives the size-based LRU
+    eviction; the files' own mtimes record when they were written and drive
+    the TTL.
+    """
+
+    def __init__(self, directory=IMAGE_CACHE_DIR, max_bytes=IMAGE_CACHE_MAX_BYTES,
+                 ttl=IMAGE_CACHE_TTL, memory_entries=IMAGE_CACHE_MEMORY_ENTRIES,
+                 memory_bytes=IMAGE_CACHE_MEMORY_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._memory = LRUCache(memory_entries, ttl=ttl, max_bytes=memory_bytes,
+                                sizeof=lambda images: sum(map(len, images)))
+        self._lock = threading.Lock()
+        self._disk_bytes = None
+
+    def _entry_dir(self, key):
+        return self.directory / key
+
+    def _read_entry(self, key):
+        entry = self._entry_dir(key)
+        files = sorted(entry.glob("*.img"), key=lambda p: int(p.stem)) if entry.is_dir() else []
+        if not files:
+            return None
+        if self.ttl is not None and time.time() - files[0].stat().st_mtime > self.ttl:
+            self._remove(key)
+            return None
+        os.utime(entry)
+        return [f.read_bytes() for f in files]
+
+    def _remove(self, key):
+        entry = self._entry_dir(key)
+        size = sum(f.stat().st_size for f in entry.glob("*.img"))
+        shutil.rmtree(entry, ignore_errors=True)
+        if self._disk_bytes is not None:
+            self._disk_bytes -= size
+
+    def _scan(self):
+        entries = []
+        if self.directory.is_dir():
+            for entry in self.directory.iterdir():
+                if entry.is_dir():
+                    size = sum(f.stat().st_size for f in entry.glob("*.img"))
+                    entries.append((entry.stat().st_mtime, entry.name, size))
+        return entries
+
+    def _enforce_limit(self):
+        entries = self._scan()
+        self._disk_bytes = sum(size for _, _, size in entries)
+        for _, key, _ in sorted(entries):
+            if self._disk_bytes <= self.max_bytes:
+                break
+            self._memory.pop(key)
+            self._remove(key)
+
+    def __contains__(self, params):
+        """Whether ``params`` is cached, without reading the images or counting a hit."""
+        key = cache_key(params)
+        if key in self._memory:
+            return True
+        files = list(self._entry_dir(key).glob("*.img"))
+        return bool(files) and (self.ttl is None or time.time() - min(f.stat().st_mtime for f in files) <= self.ttl)
+
+    def get(self, params):
+        """Return the cached list of image bytes for ``params``, or None."""
+        key = cache_key(params)
+        images = self._memory.get(key)
+        if images is None:
+            with self._lock:
+                images = self._read_entry(key)
+            if images is not None:
+                self._memory.put(key, images)
+        if images is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return images
+
+    def put(self, params, images):
+        key = cache_key(params)
+        self._memory.put(key, list(images))
+        with self._lock:
+            entry = self._entry_dir(key)
+            if entry.exists():
+                self._remove(key)
+            tmp = self.directory / f".{key}.tmp"
+            tmp.mkdir(parents=True, exist_ok=True)
+            for i, data in enumerate(images):
+                (tmp / f"{i}.img").write_bytes(data)
+            os.replace(tmp, entry)
+            self._enforce_limit()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self._disk_bytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory.bytes,
+            "disk_bytes": self._disk_bytes,
+        }
+
+
+image_cache = ImageCache()
+metrics.register("image_cache", image_cache.stats)
@@ -0,0 +1,382 @@
+"""Background jobs for image generation.
+
+A click submits a job and returns immediately. The Streamlit script thread
+never blocks on the provider, and a rerun (or another click) doesn't throw
+away a render that is already paid for. Jobs live in a process-wide
+registry by id, and each slot of ``job.results`` fills in as its image
+arrives. Each session runs at most ``NEXUS_SESSION_JOBS`` jobs at a time;
+the rest wait in a queue of their own, and free workers take the sessions
+in turn, so one busy session can't hold every worker.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from nexus.config import env_float, env_int
+from nexus.generation import iter_images
+from nexus.history import history
+from nexus.image_cache import image_cache
+from nexus.lru import LRUCache
+from nexus.metrics import metrics
+from nexus.postprocess import postprocessor
+from nexus.scheduler import RequestDropped
+from nexus.singleflight import coalescer
+from nexus.usage import QuotaExceeded, usage
+
+JOB_WORKERS = env_int("NEXUS_JOB_WORKERS", 8)
+# One click can start two jobs (the preview and the full render)
+SESSION_JOBS = env_int("NEXUS_SESSION_JOBS", 2)
+JOB_RETENTION = env_int("NEXUS_JOB_RETENTION", 500)
+JOB_TTL = env_float("NEXUS_JOB_TTL", 3600)
+# Image bytes kept in memory for finished jobs; older results are released
+# (they remain in the history store)
+SESSION_IMAGE_BYTES = env_int("NEXUS_SESSION_IMAGE_MB", 64) * 1024 * 1024
+JOB_IMAGE_BYTES = env_int("NEXUS_JOB_IMAGE_MB", 512) * 1024 * 1024
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+# Failures that belong to the session making a call, not to the others sharing its flight
+CALLER_ERRORS = (QuotaExceeded, RequestDropped)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, params, session=None, kind="image"):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.params = params
+        self.session = session
+        self.status = QUEUED
+        self.results = [None] * params.get("n", 1)
+        self.errors = {}
+        self.error = None
+        self.from_cache = False
+        self.cached = 0
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_requested = False
+        self.released = False
+        self.processed = {}
+        self.postprocess = None
+        self.preview_id = None
+        self.generation_id = None
+        self.future = None
+
+    @property
+    def completed(self):
+        return sum(result is not None for result in self.results) + len(self.errors)
+
+    @property
+    def active(self):
+        return self.status in (QUEUED, RUNNING)
+
+    @property
+    def nbytes(self):
+        return (sum(len(result) for result in self.results if isinstance(result, bytes))
+                + sum(len(data) for data, _ in self.processed.values()))
+
+    @property
+    def releasable(self):
+        """Whether dropping the results loses nothing: they're in the history (sweeps save
+        theirs cell by cell), or it's a preview nobody looks at once the job is done."""
+        return self.generation_id is not None or self.kind in ("sweep", "preview")
+
+    def release(self):
+        """Drop the image bytes of a finished job; returns how many bytes were freed."""
+        freed = self.nbytes
+        if freed:
+            self.results = [None] * len(self.results)
+            self.processed = {}
+            self.released = True
+        return freed
+
+    @property
+    def seconds(self):
+        if self.started is None:
+            return None
+        return (self.finished or time.time()) - self.started
+
+
+def cache_results(params):
+    """``on_complete`` callback storing a finished flight's images in the image cache.
+
+    A flight abandoned part way still paid for the images it got; they're
+    cached as the answer to the same request with a smaller ``n``.
+    """
+    def put(events):
+        results = [result for _, result in sorted(events, key=lambda event: event[0])]
+        if results and all(isinstance(result, bytes) for result in results):
+            image_cache.put(dict(params, n=len(results)), results)
+    return put
+
+
+def run_image_job(job, client, parallel=1, use_cache=True, postprocess=None, record=True):
+    """Generate (or load from cache) ``job.params``, filling ``job.results`` as images arrive.
+
+    With ``postprocess`` (``{"steps": [...], "format": "WEBP", "quality": 85}``)
+    every image is also sent through the post-processing pipeline as soon
+    as it arrives. ``job.processed[i]`` then holds (bytes, stage timings).
+    The cache and history keep the originals. ``record=False`` keeps
+    throwaway renders (e.g. previews) out of the history.
+    """
+    params = job.params
+    job.postprocess = postprocess
+    pending = {}
+
+    def arrived(i, result):
+        job.results[i] = result
+        if postprocess and isinstance(result, bytes):
+            pending[i] = postprocessor.submit(result, postprocess["steps"], postprocess["format"],
+                                              postprocess["quality"])
+
+    cached = image_cache.get(params) if use_cache else None
+    if cached is not None:
+        job.results = [None] * len(cached)
+        job.from_cache = True
+        usage.record_saved(getattr(client, "key", None), job.session, params)
+        for i, result in enumerate(cached):
+            arrived(i, result)
+        if record:
+            # The images may have been paid for by another key; this key's history needs its own entry
+            job.generation_id = history.record_images(params, cached, session=job.session,
+                                                      owner=getattr(client, "key", None))
+    else:
+        started = time.perf_counter()
+        key = getattr(client, "key", None)
+        joined = []  # [True] if this job leads its flight, [False] if it joined another's
+        # Identical requests in flight from other sessions on this key share one provider call
+        stream = coalescer.stream(
+            params,
+            lambda cancelled: iter_images(client, params, parallel, cancelled=cancelled),
+            on_complete=cache_results(params),
+            cancelled=lambda: job.cancel_requested,
+            scope=key,
+            on_join=joined.append,
+        )
+        failures = {}
+        try:
+            for i, result in stream:
+                if job.cancel_requested:
+                    raise JobCancelled()
+                if i >= len(job.results):
+                    job.results.extend([None] * (i + 1 - len(job.results)))
+                if isinstance(result, Exception):
+                    failures[i] = result
+                    if not (joined == [False] and isinstance(result, CALLER_ERRORS)):
+                        job.errors[i] = str(result)
+                else:
+                    arrived(i, result)
+        except CALLER_ERRORS as e:
+            if joined != [False]:
+                raise
+            # The flight's leader hit its own quota or queue limit; that says nothing about ours
+            failures.update((i, e) for i, result in enumerate(job.results) if result is None)
+        finally:
+            stream.close()
+        if job.cancel_requested:
+            raise JobCancelled()
+
+        if joined == [False]:
+            shared = sum(result is not None for result in job.results)
+            if shared:
+                usage.record_saved(key, job.session, dict(params, n=shared))
+            # Redo with our own client the images that failed for reasons of the leader's
+            retry = [i for i, error in sorted(failures.items()) if isinstance(error, CALLER_ERRORS)]
+            if retry:
+                for j, result in iter_images(client, dict(params, n=len(retry)), parallel,
+                                             cancelled=lambda: job.cancel_requested):
+                    if isinstance(result, Exception):
+                        failures[retry[j]] = result
+                        job.errors[retry[j]] = str(result)
+                    else:
+                        del failures[retry[j]]
+                        arrived(retry[j], result)
+                if job.cancel_requested:
+                    raise JobCancelled()
+
+        if record and any(result is not None for result in job.results):
+            job.generation_id = history.record_images(params, job.results, seconds=time.perf_counter() - started,
+                                                      session=job.session, owner=key)
+        elif not any(result is not None for result in job.results) and failures:
+            raise failures[min(failures)]  # the first error, so callers can tell e.g. a used-up quota apart
+
+    for i, future in pending.items():
+        if job.cancel_requested:
+            future.cancel()
+            continue
+        try:
+            job.processed[i] = future.result()
+        except Exception as e:
+            job.errors[i] = f"Post-processing failed: {e}"
+
+
+def run_history_job(job, generation_id, owner=None):
+    """Show a past generation again from the history store instead of generating it.
+
+    With ``owner`` (a key fingerprint), only that key's entries can be shown.
+    """
+    entry = history.get(generation_id, owner=owner)
+    if entry is None:
+        raise LookupError(f"History entry {generation_id} no longer exists")
+    results = [history.blob(image["sha"]) if image["sha"] else image["url"] for image in entry["images"]]
+    job.results = results
+    job.from_cache = True
+    job.generation_id = generation_id
+
+
+class JobQueue:
+    def __init__(self, max_workers=JOB_WORKERS, retention=JOB_RETENTION, ttl=JOB_TTL,
+                 session_bytes=SESSION_IMAGE_BYTES, max_bytes=JOB_IMAGE_BYTES, session_jobs=SESSION_JOBS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="nexus-job")
+        self.max_workers = max_workers
+        self.session_jobs = session_jobs
+        # Jobs waiting for a worker, per session; the session at the front goes next
+        self._waiting = OrderedDict()
+        self._running = {}
+        self._dispatch_lock = threading.Lock()
+        # Finished jobs are kept for ``ttl`` seconds; the bound covers bursts
+        self._jobs = LRUCache(retention, ttl=ttl)
+        self.session_bytes = session_bytes
+        self.max_bytes = max_bytes
+        self.released = 0
+
+    def submit(self, fn, params, session=None, kind="image", preview_id=None, **kwargs):
+        """Queue ``fn(job, **kwargs)`` and return the Job right away.
+
+        ``preview_id`` links a quick preview job, which is cancelled along
+        with this one and once this one has finished.
+        """
+        job = Job(params, session=session, kind=kind)
+        job.preview_id = preview_id
+        job.future = Future()
+        self._jobs.put(job.id, job)
+        with self._dispatch_lock:
+            self._waiting.setdefault(session, deque()).append((job, fn, kwargs))
+        self._dispatch()
+        return job
+
+    def _next(self):
+        """The next waiting job, taking the sessions under their cap in turn."""
+        for session in list(self._waiting):
+            if self._running.get(session, 0) >= self.session_jobs:
+                continue
+            waiting = self._waiting.pop(session)
+            item = waiting.popleft()
+            if waiting:
+                self._waiting[session] = waiting  # to the back of the line
+            return item
+        return None
+
+    def _dispatch(self):
+        """Hand waiting jobs to free workers."""
+        with self._dispatch_lock:
+            while sum(self._running.values()) < self.max_workers:
+                item = self._next()
+                if item is None:
+                    break
+                job, fn, kwargs = item
+                if not job.future.set_running_or_notify_cancel():
+                    continue  # cancelled while it waited
+                self._running[job.session] = self._running.get(job.session, 0) + 1
+                self._executor.submit(self._run, job, fn, kwargs)
+
+    def _run(self, job, fn, kwargs):
+        try:
+            self._execute(job, fn, kwargs)
+        except BaseException as e:
+            job.future.set_exception(e)
+        else:
+            job.future.set_result(None)
+        finally:
+            with self._dispatch_lock:
+                self._running[job.session] -= 1
+                if not self._running[job.session]:
+                    del self._running[job.session]
+            self._dispatch()
+
+    def _execute(self, job, fn, kwargs):
+        if job.cancel_requested:
+            job.status = CANCELLED
+            return
+        job.status = RUNNING
+        job.started = time.time()
+        try:
+            fn(job, **kwargs)
+        except JobCancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            job.status = FAILED
+            job.error = e
+        else:
+            job.status = DONE
+        finally:
+            job.finished = time.time()
+            if job.preview_id:
+                self.cancel(job.preview_id)  # the final images are in (or never coming): stop paying for the preview
+            self._jobs.put(job.id, job)  # restart the retention clock from completion
+            self.enforce_budgets(keep=job)
+
+    def enforce_budgets(self, keep=None):
+        """Release the results of the least recently viewed finished jobs until
+        every session, and the process as a whole, is within its byte budget.
+        ``keep`` (the job that just finished) is never released, and neither are
+        jobs whose results couldn't be loaded from the history again.
+        """
+        self._jobs.expire()
+        finished = [job for job in self._jobs.values() if not job.active and job.releasable and job is not keep]
+        by_session = {}
+        for job in finished:
+            by_session.setdefault(job.session, []).append(job)
+        for session, session_jobs in by_session.items():
+            excess = sum(job.nbytes for job in self._jobs.values() if job.session == session) - self.session_bytes
+            for job in session_jobs:
+                if excess <= 0:
+                    break
+                excess -= self._release(job)
+        excess = sum(job.nbytes for job in self._jobs.values()) - self.max_bytes
+        for job in finished:
+            if excess <= 0:
+                break
+            excess -= self._release(job)
+
+    def _release(self, job):
+        freed = job.release()
+        if freed:
+            self.released += 1
+        return freed
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Stop a job: queued jobs never start, running ones drop their results."""
+        job = self.get(job_id)
+        if job is None or not job.active:
+            return False
+        if job.preview_id:
+            self.cancel(job.preview_id)
+        job.cancel_requested = True
+        if job.future is not None and job.future.cancel():
+            job.status = CANCELLED
+            job.finished = time.time()
+        return True
+
+    def stats(self):
+        counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0, CANCELLED: 0}
+        with self._dispatch_lock:
+            sessions_waiting = len(self._waiting)
+        bytes_held = 0
+        for job in self._jobs.values():
+            counts[job.status] += 1
+            bytes_held += job.nbytes
+        return dict(counts, bytes=bytes_held, released=self.released, sessions_waiting=sessions_waiting)
+
+
+jobs = JobQueue()
+metrics.register("jobs", jobs.stats)
@@ -0,0 +1,142 @@
+"""Running latency model for image generation, and the latency-budget picker.
+
+Every successful ``images.generate`` call updates an exponentially weighted
+average for its exact (model, steps, resolution), plus a per-model rate in
+seconds per megapixel-step. Configurations that have never been measured
+are estimated from that rate, and the rate starts from a rough prior. So
+the picker works on a cold start and tracks the provider as it speeds up
+or slows down.
+"""
+
+import math
+import re
+import threading
+
+from nexus.config import env_float
+from nexus.metrics import metrics
+
+DEV_MODEL = "black-forest-labs/FLUX.1-dev"
+SCHNELL_MODEL = "black-forest-labs/FLUX.1-schnell"
+
+# Starting guesses (seconds per megapixel-step) until real calls come in
+PRIOR_RATES = {DEV_MODEL: 0.25, SCHNELL_MODEL: 0.2}
+DEFAULT_PRIOR_RATE = 0.25
+REQUEST_OVERHEAD = env_float("NEXUS_LATENCY_OVERHEAD", 0.5)
+LATENCY_ALPHA = env_float("NEXUS_LATENCY_ALPHA", 0.3)
+
+# Relative quality of each model at its best, and how many steps it takes
+# to get most of the way there (quality ~ 1 - exp(-steps / scale))
+MODEL_QUALITY = {DEV_MODEL: 1.0, SCHNELL_MODEL: 0.8}
+STEP_SCALE = {DEV_MODEL: 8.0, SCHNELL_MODEL: 1.5}
+CANDIDATE_STEPS = {DEV_MODEL: [8, 12, 16, 20, 28, 36, 50], SCHNELL_MODEL: [1, 2, 4, 8, 12]}
+SIZES = [512, 768, 1024]
+
+
+def megapixel_steps(steps, width, height):
+    return steps * width * height / 1e6
+
+
+def quality(model, steps, width, height, target_width, target_height):
+    """Rough 0..1 score: model ceiling x step saturation x fraction of the requested resolution."""
+    step_factor = 1 - math.exp(-steps / STEP_SCALE.get(model, 8.0))
+    resolution_factor = math.sqrt(width * height / (target_width * target_height))
+    return MODEL_QUALITY.get(model, 0.5) * step_factor * resolution_factor
+
+
+class LatencyModel:
+    def __init__(self, alpha=LATENCY_ALPHA, overhead=REQUEST_OVERHEAD):
+        self.alpha = alpha
+        self.overhead = overhead
+        self.samples = 0
+        self._exact = {}
+        self._rates = dict(PRIOR_RATES)
+        self._lock = threading.Lock()
+        self._warm = False
+
+    def warm_start(self, limit=500):
+        """Replay recent single-image generations from the history store (once)."""
+        if self._warm:
+            return
+        self._warm = True
+        from nexus.history import history
+
+        try:
+            entries = history.page(kind="image", limit=limit)
+        except Exception:
+            return
+        for entry in reversed(entries):  # oldest first, so the newest weigh most
+            if entry["seconds"] and entry["params"].get("n", 1) == 1:
+                self.record(entry["params"], entry["seconds"])
+
+    def _smooth(self, table, key, value):
+        previous = table.get(key)
+        table[key] = value if previous is None else previous + self.alpha * (value - previous)
+
+    def record(self, params, seconds):
+        """Feed one successful call; ``seconds`` is its wall time for ``params["n"]`` images."""
+        model, steps = params.get("model"), params.get("steps", 20)
+        width, height = params.get("width", 1024), params.get("height", 1024)
+        per_image = seconds / max(1, params.get("n", 1))
+        with self._lock:
+            self.samples += 1
+            self._smooth(self._exact, (model, steps, width, height), per_image)
+            work = megapixel_steps(steps, width, height)
+            if work:
+                self._smooth(self._rates, model, max(0.0, per_image - self.overhead) / work)
+
+    def predict(self, model, steps, width, height):
+        """Expected seconds for one ``n=1`` request."""
+        with self._lock:
+            exact = self._exact.get((model, steps, width, height))
+            if exact is not None:
+                return exact
+            rate = self._rates.get(model, DEFAULT_PRIOR_RATE)
+        return self.overhead + rate * megapixel_steps(steps, width, height)
+
+    def candidates(self, width, height, models=(DEV_MODEL, SCHNELL_MODEL)):
+        """Every (model, steps, width, height) at or below the requested resolution."""
+        sizes = {(width, height)} | {
+            (w, h) for w in SIZES for h in SIZES
+            if w <= width and h <= height and w * height == h * width  # same aspect ratio
+        }
+        for model in models:
+            for steps in CANDIDATE_STEPS.get(model, [20]):
+                for w, h in sizes:
+                    yield model, steps, w, h
+
+    def choose(self, budget, width=1024, height=1024, n=1, parallel=1):
+        """Best-quality configuration expected to finish ``n`` images within ``budget`` seconds.
+
+        ``n`` images run ``parallel`` at a time. If nothing fits (e.g. the
+        provider is slow), the fastest configuration is returned, which is
+        a low-step schnell render. ``within_budget`` is then False.
+        """
+        self.warm_start()
+        waves = math.ceil(n / max(1, min(parallel, n)))
+        options = []
+        for model, steps, w, h in self.candidates(width, height):
+            predicted = self.predict(model, steps, w, h) * waves
+            options.append({
+                "model": model,
+                "steps": steps,
+                "width": w,
+                "height": h,
+                "predicted": predicted,
+                "quality": quality(model, steps, w, h, width, height),
+            })
+        fitting = [option for option in options if option["predicted"] <= budget]
+        if fitting:
+            best = max(fitting, key=lambda option: (option["quality"], -option["predicted"]))
+            return dict(best, within_budget=True)
+        return dict(min(options, key=lambda option: option["predicted"]), within_budget=False)
+
+    def stats(self):
+        with self._lock:
+            stats = {"samples": self.samples, "configurations": len(self._exact)}
+            for model, rate in self._rates.items():
+                stats["rate_" + re.sub(r"[^a-z0-9]+", "_", model.split("/")[-1].lower())] = rate
+            return stats
+
+
+latency_model = LatencyModel()
+metrics.register("latency_model", latency_model.stats)
@@ -0,0 +1,306 @@
+"""Load test: many simulated browser sessions against one app process.
+
+    python -m nexus.loadtest --sessions 1 2 4 8 16 --duration 30
+    python -m nexus.loadtest --sessions 4 8 16 32 --image-latency 2 --json load.json
+
+Each session is a headless ``AppTest`` of app.py. They all run in this
+process, the way the sessions of one ``streamlit run`` share a server and
+its module-level state (job queue, caches, scheduler). A session clicks
+through prompt, text and image generation against FakeTogether, rerunning
+like the browser's polling until its images are done, and starts over
+until the level's --duration is up.
+
+Per level it reports rerun latency, reruns/s, event-loop lag, CPU and RSS
+(per session too). Rerun percentiles are for the polling reruns, which
+only cost the app's own work; reruns after a click also wait for the
+(fake) provider and are reported separately, as are a session's first
+page loads. Event-loop lag is measured on an asyncio loop running
+in a thread, as Streamlit's server loop does, so it shows how late the
+server would be to answer a websocket message. The first level where rerun
+p95 or loop lag goes over its limit, or reruns/s stop growing with more
+sessions, is the saturation point; the ramp stops there.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+APP = Path(__file__).resolve().parent.parent / "app.py"
+
+
+def share_app_test_state():
+    """Let AppTests run at the same time, sharing what a server's sessions share.
+
+    Around every run, AppTest installs a mock Runtime and patches config
+    lookups, then undoes both; with runs overlapping, one run's cleanup pulls
+    the Runtime from under another and patches pile up. Here the first
+    Runtime stays installed for every session, the config override is applied
+    once, and app.py is compiled once (AppTest would recompile it per rerun).
+    """
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import app_test, local_script_runner, util
+
+    class SharedRuntimeType(type(Runtime)):
+        def __setattr__(cls, name, value):
+            if name != "_instance":
+                super().__setattr__(name, value)
+            elif value is not None and Runtime._instance is None:
+                Runtime._instance = value
+
+    app_test.Runtime = SharedRuntimeType("Runtime", (Runtime,), {})
+    config.get_option = util.build_mock_config_get_option({"global.appTest": True})
+    app_test.patch_config_options = lambda overrides: contextlib.nullcontext()
+    script_cache = ScriptCache()
+    local_script_runner.ScriptCache = lambda: script_cache
+
+
+class LoopLag:
+    """Ticks an asyncio loop on its own thread and records how late each tick wakes up."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = []
+        self._running = False
+        self._thread = None
+
+    async def _tick(self):
+        while self._running:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - started - self.interval))
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=asyncio.run, args=(self._tick(),), name="nexus-loop-lag", daemon=True)
+        self._thread.start()
+
+    def reset(self):
+        self.samples = []
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+
+
+class Session:
+    """One simulated user: prompt -> text -> images, over and over."""
+
+    def __init__(self, index, args, rerun_times):
+        self.index = index
+        self.args = args
+        self.rerun_times = rerun_times
+        self.scenarios = 0
+        self.errors = 0
+        self.at = None
+
+    def _run(self, kind="poll"):
+        started = time.perf_counter()
+        self.at.run()
+        self.rerun_times[kind].append(time.perf_counter() - started)
+        if self.at.exception:
+            self.errors += 1
+
+    def _click(self, label):
+        button = next((b for b in self.at.button if b.label == label), None)
+        if button is None or button.disabled:
+            self.errors += 1
+            return
+        button.click()
+        self._run("action")
+
+    def _images_done(self):
+        from nexus.jobs import jobs
+
+        job_ids = self.at.session_state["image_jobs"] if "image_jobs" in self.at.session_state else []
+        return not any(job.active for job in map(jobs.get, job_ids) if job)
+
+    def start(self):
+        from streamlit.testing.v1 import AppTest
+
+        self.at = AppTest.from_file(str(APP), default_timeout=self.args.timeout)
+        self._run("start")
+        key = "load-key" if self.args.shared_key else f"load-key-{self.index}"
+        self.at.text_input[0].input(key)
+        self._run("start")
+
+    def scenario(self):
+        i = self.scenarios
+        prompt = f"a futuristic city #{self.index}-{i % self.args.unique if self.args.unique else i}"
+        self.at.text_area(key="prompt_idea").input(prompt)
+        self._click("🪄 Generate Professional Prompt")
+        self.at.text_area(key="main_prompt").input(prompt)
+        self._click("📝 Generate Text")
+        self._click("🚀 Generate Images")
+        deadline = time.perf_counter() + self.args.timeout
+        while not self._images_done() and time.perf_counter() < deadline:
+            time.sleep(self.args.poll)
+            self._run()
+        self.scenarios += 1
+
+    def run(self, deadline):
+        try:
+            self.start()
+            while time.perf_counter() < deadline:
+                self.scenario()
+        except Exception:
+            self.errors += 1
+
+
+def run_level(sessions, args, lag):
+    from nexus.benchmark import percentile, rss_mb
+
+    rerun_times = {"start": [], "action": [], "poll": []}
+    workers = [Session(i, args, rerun_times) for i in range(sessions)]
+    rss_before = rss_mb()
+    cpu_before = time.process_time()
+    lag.reset()
+    started = time.perf_counter()
+    deadline = started + args.duration
+    threads = [threading.Thread(target=w.run, args=(deadline,), name=f"nexus-load-{w.index}") for w in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    cpu = time.process_time() - cpu_before
+    rss = rss_mb()
+    lags = list(lag.samples)
+    polls, actions = rerun_times["poll"], rerun_times["action"]
+    reruns = sum(map(len, rerun_times.values()))
+    result = {
+        "sessions": sessions,
+        "reruns": reruns,
+        "reruns_per_s": reruns / wall,
+        "scenarios": sum(w.scenarios for w in workers),
+        "errors": sum(w.errors for w in workers),
+        "rerun_p50_ms": percentile(polls, 0.50) * 1000,
+        "rerun_p95_ms": percentile(polls, 0.95) * 1000,
+        "rerun_p99_ms": percentile(polls, 0.99) * 1000,
+        "action_p50_ms": percentile(actions, 0.50) * 1000,
+        "action_p95_ms": percentile(actions, 0.95) * 1000,
+        "start_p95_ms": percentile(rerun_times["start"], 0.95) * 1000,
+        "lag_p95_ms": percentile(lags, 0.95) * 1000,
+        "lag_max_ms": max(lags, default=0.0) * 1000,
+        "cpu_percent": 100 * cpu / wall,
+        "cpu_ms_per_rerun": 1000 * cpu / max(1, reruns),
+        "rss_mb": rss,
+        "rss_mb_per_session": max(0.0, rss - rss_before) / sessions,
+    }
+    for worker in workers:
+        worker.at = None  # let the level's sessions go before the next one starts
+    return result
+
+
+def saturation(result, previous, args):
+    """Why ``result``'s level counts as saturated, or None."""
+    if result["rerun_p95_ms"] > args.max_rerun_p95 * 1000:
+        return f"polling rerun p95 {result['rerun_p95_ms']:.0f}ms > {args.max_rerun_p95:g}s"
+    if result["lag_p95_ms"] > args.max_lag * 1000:
+        return f"event-loop lag p95 {result['lag_p95_ms']:.0f}ms > {args.max_lag:g}s"
+    if previous is not None:
+        scale = result["sessions"] / previous["sessions"]
+        gain = result["reruns_per_s"] / previous["reruns_per_s"] if previous["reruns_per_s"] else scale
+        if gain < 1 + args.min_gain * (scale - 1):
+            return f"reruns/s grew {gain:.2f}x for {scale:.2g}x sessions"
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find how many concurrent sessions one app process can take")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32],
+                        help="Concurrent sessions per level, ramped in order (default: %(default)s)")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds per level (default: %(default)s)")
+    parser.add_argument("--poll", type=float, default=1.0,
+                        help="Seconds between reruns while images are generating, like the app's polling")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Limit for one rerun or one image job")
+    parser.add_argument("--unique", type=int, default=0,
+                        help="Distinct prompts per session (0 = every scenario is new, i.e. no cache hits)")
+    parser.add_argument("--shared-key", action="store_true",
+                        help="All sessions use one API key, sharing its rate limit")
+    parser.add_argument("--text-latency", type=float, default=0.2)
+    parser.add_argument("--token-latency", type=float, default=0.005)
+    parser.add_argument("--image-latency", type=float, default=1.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--max-rerun-p95", type=float, default=1.0,
+                        help="Polling rerun p95 in seconds above which a level is saturated (default: %(default)s)")
+    parser.add_argument("--max-lag", type=float, default=0.1,
+                        help="Event-loop lag p95 in seconds above which a level is saturated (default: %(default)s)")
+    parser.add_argument("--min-gain", type=float, default=0.25,
+                        help="Share of the added sessions reruns/s must grow by to not count as saturated")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args(argv)
+
+    data_dir = tempfile.mkdtemp(prefix="nexus-load-")
+    # Settings are read at import time, so configure before importing the app's modules
+    os.environ["NEXUS_DATA_DIR"] = data_dir
+    os.environ.setdefault("NEXUS_POSTPROCESS_WORKERS", "0")
+    # Deprecation notices from every rerun of every session would drown the report
+    from streamlit import config, logger
+
+    config.set_option("logger.level", "error")
+    logger.set_log_level("ERROR")
+    share_app_test_state()
+
+    from nexus.clients import registry
+    from nexus.fake_together import FakeTogether
+
+    fake = FakeTogether(
+        text_latency=args.text_latency,
+        token_latency=args.token_latency,
+        image_latency=args.image_latency,
+        error_rate=args.error_rate,
+    )
+    registry._factory = lambda _: fake
+
+    lag = LoopLag()
+    lag.start()
+    results = []
+    saturated = None
+    print(f"{'sessions':>9}{'reruns/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'click p95':>11}{'lag p95':>9}"
+          f"{'lag max':>9}{'cpu %':>7}{'rss MB':>8}{'MB/sess':>9}{'err':>5}")
+    try:
+        for sessions in args.sessions:
+            result = run_level(sessions, args, lag)
+            results.append(result)
+            print(f"{sessions:>9}{result['reruns_per_s']:>10.1f}{result['rerun_p50_ms']:>9.0f}"
+                  f"{result['rerun_p95_ms']:>9.0f}{result['rerun_p99_ms']:>9.0f}{result['action_p95_ms']:>11.0f}"
+                  f"{result['lag_p95_ms']:>9.1f}"
+                  f"{result['lag_max_ms']:>9.1f}{result['cpu_percent']:>7.0f}{result['rss_mb']:>8.0f}"
+                  f"{result['rss_mb_per_session']:>9.1f}{result['errors']:>5}")
+            reason = saturation(result, results[-2] if len(results) > 1 else None, args)
+            if reason:
+                saturated = {"sessions": sessions, "reason": reason}
+                break
+    finally:
+        lag.stop()
+
+    if saturated:
+        healthy = [r["sessions"] for r in results if r["sessions"] < saturated["sessions"]]
+        print(f"Saturated at {saturated['sessions']} sessions ({saturated['reason']}); "
+              f"last healthy level: {healthy[-1] if healthy else 'none'}")
+    else:
+        print(f"No saturation up to {results[-1]['sessions']} sessions; try larger --sessions levels")
+    print(f"provider calls {fake.calls}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(
+            {"args": vars(args), "results": results, "saturated": saturated, "provider_calls": fake.calls},
+            indent=2,
+        ))
+    shutil.rmtree(data_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
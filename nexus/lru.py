@@ -0,0 +1,128 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread-safe LRU mapping with an optional max age per entry.
+
+    With ``sliding=True`` the age is measured from the last ``get`` rather
+    than from the last ``put``, i.e. the TTL becomes an idle timeout.
+
+    With ``max_bytes`` the total ``sizeof(value)`` is bounded too; a value
+    larger than the whole budget is not stored at all.
+
+    ``on_evict(key, value)`` is called for entries dropped by the size bound,
+    by expiry, or by ``clear()`` - but not for entries replaced by ``put``.
+    """
+
+    def __init__(self, max_entries=128, ttl=None, on_evict=None, sliding=False, clock=time.monotonic,
+                 max_bytes=None, sizeof=len):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self.ttl = ttl
+        self.sliding = sliding
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data and not self._expired(self._data[key][1])
+
+    def _expired(self, stamp):
+        return self.ttl is not None and self._clock() - stamp > self.ttl
+
+    def _size(self, value):
+        return self.sizeof(value) if self.max_bytes is not None else 0
+
+    def _drop(self, key):
+        value, _ = self._data.pop(key)
+        self.bytes -= self._size(value)
+        if self.on_evict:
+            self.on_evict(key, value)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or self._expired(entry[1]):
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return default
+            if self.sliding:
+                self._data[key] = (entry[0], self._clock())
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        with self._lock:
+            size = self._size(value)
+            if key in self._data:
+                self.bytes -= self._size(self._data[key][0])
+            if self.max_bytes is not None and size > self.max_bytes:
+                self._data.pop(key, None)
+                return
+            self._data[key] = (value, self._clock())
+            self._data.move_to_end(key)
+            self.bytes += size
+            while len(self._data) > self.max_entries or (
+                self.max_bytes is not None and self.bytes > self.max_bytes
+            ):
+                self._drop(next(iter(self._data)))
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return default
+            self.bytes -= self._size(entry[0])
+            return entry[0]
+
+    def values(self):
+        """Snapshot of the live values, least recently used first."""
+        with self._lock:
+            return [value for value, stamp in self._data.values() if not self._expired(stamp)]
+
+    def touch(self, key):
+        """Refresh an entry's timestamp so it counts as recently used."""
+        with self._lock:
+            if key in self._data:
+                self._data[key] = (self._data[key][0], self._clock())
+                self._data.move_to_end(key)
+
+    def expire(self):
+        """Drop every entry older than the TTL; returns how many were dropped."""
+        with self._lock:
+            stale = [k for k, (_, stamp) in self._data.items() if self._expired(stamp)]
+            for key in stale:
+                self._drop(key)
+            return len(stale)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._data):
+                self._drop(key)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            stats = {
+                "entries": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+            if self.max_bytes is not None:
+                stats["bytes"] = self.bytes
+            return stats
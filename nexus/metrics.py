@@ -0,0 +1,231 @@
+"""In-process metrics: latency/size histograms, counters and gauge collectors.
+
+Stages are timed with ``timed("image", model=..., steps=...)``. Everything
+can be rendered in the Prometheus text format, served over HTTP when
+``NEXUS_METRICS_PORT`` is set, and/or dumped periodically as JSON to
+``NEXUS_METRICS_JSON``.
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from nexus.config import env_float
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(10))  # 1 KiB .. 256 MiB
+
+PREFIX = "nexus_"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimate by linear interpolation inside the bucket holding the q-th value."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._collectors = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(buckets)
+            self._histograms[key].observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def register(self, name, collector):
+        """Add gauges computed on export: ``collector()`` returns {gauge: value}."""
+        self._collectors[name] = collector
+
+    @contextmanager
+    def timed(self, stage, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc("stage_errors", stage=stage)
+            raise
+        finally:
+            self.observe("stage_seconds", time.perf_counter() - started, stage=stage, **labels)
+
+    def gauges(self):
+        values = {}
+        for name, collector in list(self._collectors.items()):
+            try:
+                stats = collector()
+            except Exception:
+                continue
+            for gauge, value in stats.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    values[(f"{name}_{gauge}", ())] = value
+        return values
+
+    def snapshot(self):
+        """JSON-friendly view of everything recorded so far."""
+        with self._lock:
+            histograms = [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": h.count,
+                    "sum": h.sum,
+                    "p50": h.quantile(0.5),
+                    "p95": h.quantile(0.95),
+                    "p99": h.quantile(0.99),
+                }
+                for (name, labels), h in self._histograms.items()
+            ]
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in self._counters.items()
+            ]
+        gauges = [
+            {"name": name, "labels": dict(labels), "value": value}
+            for (name, labels), value in self.gauges().items()
+        ]
+        return {"time": time.time(), "histograms": histograms, "counters": counters, "gauges": gauges}
+
+    def render_prometheus(self):
+        lines = []
+
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+        with self._lock:
+            typed = set()
+            for (name, labels), h in sorted(self._histograms.items()):
+                metric = PREFIX + name
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} histogram")
+                    typed.add(metric)
+                cumulative = 0
+                for bound, n in zip(h.buckets, h.counts):
+                    cumulative += n
+                    lines.append(f"{metric}_bucket{fmt(labels, [('le', _number(bound))])} {cumulative}")
+                lines.append(f"{metric}_bucket{fmt(labels, [('le', '+Inf')])} {h.count}")
+                lines.append(f"{metric}_sum{fmt(labels)} {_number(h.sum)}")
+                lines.append(f"{metric}_count{fmt(labels)} {h.count}")
+            for (name, labels), value in sorted(self._counters.items()):
+                metric = PREFIX + name + "_total"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} counter")
+                    typed.add(metric)
+                lines.append(f"{metric}{fmt(labels)} {_number(value)}")
+        for (name, labels), value in sorted(self.gauges().items()):
+            metric = PREFIX + name
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} gauge")
+                typed.add(metric)
+            lines.append(f"{metric}{fmt(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path):
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp, path)
+
+
+metrics = Metrics()
+timed = metrics.timed
+observe = metrics.observe
+inc = metrics.inc
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+def _serve(port):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = metrics.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, name="nexus-metrics-http", daemon=True).start()
+
+
+def _sink(path, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            metrics.write_json(path)
+        except OSError:
+            pass
+
+
+def start_exporters():
+    """Start the HTTP endpoint and/or JSON sink configured in the environment (once per process)."""
+    global _exporters_started
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+    port = os.environ.get("NEXUS_METRICS_PORT")
+    if port:
+        _serve(int(port))
+    path = os.environ.get("NEXUS_METRICS_JSON")
+    if path:
+        interval = env_float("NEXUS_METRICS_INTERVAL", 15.0)
+        threading.Thread(target=_sink, args=(path, interval), name="nexus-metrics-json", daemon=True).start()
@@ -0,0 +1,71 @@
+"""Measure how many bytes of element data one rerun of app.py sends.
+
+    python -m nexus.payload
+    python -m nexus.payload --compare    # stylesheet link vs. inline CSS
+
+Runs the app headlessly with Streamlit's AppTest and sums the serialized
+size of every element and block the script emits, i.e. roughly what goes
+over the websocket on each widget interaction.
+"""
+
+import argparse
+import os
+import sys
+from pathlib import Path
+
+APP = Path(__file__).resolve().parent.parent / "app.py"
+
+
+def _walk(node):
+    yield node
+    children = getattr(node, "children", None)
+    if isinstance(children, dict):
+        for child in children.values():
+            yield from _walk(child)
+
+
+def measure(app=APP, top=5):
+    """Return (total bytes, [(bytes, element type, preview)]) for one rerun."""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(str(app), default_timeout=60).run()
+    at.run()  # the second run is what every widget interaction costs
+    sizes = []
+    for node in _walk(at._tree):
+        proto = getattr(node, "proto", None)
+        if proto is None or not hasattr(proto, "ByteSize"):
+            continue
+        preview = str(getattr(node, "value", "") or "")[:60].replace("\n", " ")
+        sizes.append((proto.ByteSize(), node.type, preview))
+    sizes.sort(reverse=True)
+    return sum(size for size, _, _ in sizes), sizes[:top]
+
+
+def report(label):
+    total, largest = measure()
+    print(f"{label}: {total:,} bytes per rerun")
+    for size, kind, preview in largest:
+        print(f"  {size:>8,}  {kind:<12} {preview}")
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bytes of element data sent per rerun of app.py")
+    parser.add_argument("--compare", action="store_true",
+                        help="Also measure with the CSS inlined (NEXUS_INLINE_CSS=1)")
+    args = parser.parse_args(argv)
+
+    if not args.compare:
+        report("current")
+        return 0
+
+    os.environ["NEXUS_INLINE_CSS"] = "1"
+    inline = report("inline CSS")
+    os.environ["NEXUS_INLINE_CSS"] = "0"
+    linked = report("linked stylesheet")
+    print(f"saved {inline - linked:,} bytes ({(inline - linked) / inline:.0%}) per rerun")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
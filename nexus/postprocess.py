@@ -0,0 +1,190 @@
+"""Optional post-processing of generated images: upscale, levels, watermark,
+thumbnail, then re-encode (WebP, AVIF, JPEG or PNG).
+
+A pipeline is a list of ``(stage, argument)`` pairs, e.g. from
+``parse_pipeline("upscale:2,levels,watermark:NexusAI,thumbnail:1024")``.
+Pipelines run on a process pool, so the CPU-heavy resampling and encoding
+neither blocks the script thread nor holds the GIL of the server process.
+Each run returns the encoded bytes and the seconds spent in every stage.
+"""
+
+import importlib.util
+import os
+import threading
+import time
+from concurrent.futures import Future
+from io import BytesIO
+
+from nexus.config import env_int
+from nexus.metrics import inc, observe
+
+POSTPROCESS_WORKERS = env_int("NEXUS_POSTPROCESS_WORKERS", min(4, os.cpu_count() or 1))
+
+
+def _avif_available():
+    """Whether Pillow can write AVIF (11.2+ built with libavif), checked without importing PIL.Image."""
+    try:
+        return importlib.util.find_spec("PIL._avif") is not None
+    except ImportError:
+        return False
+
+
+OUTPUT_FORMATS = ("WEBP", "AVIF", "JPEG", "PNG") if _avif_available() else ("WEBP", "JPEG", "PNG")
+EXTENSIONS = {"WEBP": "webp", "AVIF": "avif", "JPEG": "jpg", "PNG": "png"}
+
+
+def upscale(image, factor):
+    from PIL import Image
+
+    width, height = image.size
+    return image.resize((round(width * factor), round(height * factor)), Image.LANCZOS)
+
+
+def levels(image, clip=1.0):
+    """Stretch each channel so the ``clip``-th percentiles map to black and white.
+
+    Percentiles come from the channel histograms and the stretch is applied
+    as a lookup table, so the cost doesn't depend on float maths per pixel.
+    """
+    import numpy as np
+
+    image = image.convert("RGB")
+    histograms = np.asarray(image.histogram(), dtype=np.float64).reshape(3, 256)
+    cdf = np.cumsum(histograms, axis=1) / histograms.sum(axis=1, keepdims=True)
+    low = np.array([np.searchsorted(channel, clip / 100) for channel in cdf])
+    high = np.array([np.searchsorted(channel, 1 - clip / 100) for channel in cdf])
+    scale = 255.0 / np.maximum(high - low, 1)
+    table = np.clip((np.arange(256) - low[:, None]) * scale[:, None], 0, 255).astype(np.uint8)
+    return image.point(table.ravel().tolist())
+
+
+def watermark(image, text):
+    from PIL import Image, ImageDraw, ImageFont
+
+    base = image.convert("RGBA")
+    overlay = Image.new("RGBA", base.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    font = ImageFont.load_default(size=max(12, base.width // 40))
+    left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+    margin = max(8, base.width // 80)
+    position = (base.width - (right - left) - margin, base.height - (bottom - top) - margin)
+    draw.text(position, text, font=font, fill=(255, 255, 255, 160), stroke_width=1, stroke_fill=(0, 0, 0, 120))
+    return Image.alpha_composite(base, overlay).convert("RGB")
+
+
+def thumbnail(image, max_side):
+    from PIL import Image
+
+    image = image.copy()
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+    return image
+
+
+# stage name -> (function, argument parser, default argument)
+STAGES = {
+    "upscale": (upscale, float, 2.0),
+    "levels": (levels, float, 1.0),
+    "watermark": (watermark, str, "NexusAI Studio"),
+    "thumbnail": (thumbnail, int, 512),
+}
+
+
+def parse_pipeline(spec):
+    """``"upscale:2,levels,watermark:NexusAI"`` -> [("upscale", 2.0), ("levels", 1.0), ...]"""
+    steps = []
+    for part in filter(None, (part.strip() for part in (spec or "").split(","))):
+        name, _, argument = part.partition(":")
+        if name not in STAGES:
+            raise ValueError(f"Unknown post-processing stage {name!r} (choose from {', '.join(STAGES)})")
+        _, parse, default = STAGES[name]
+        steps.append((name, parse(argument) if argument else default))
+    return steps
+
+
+def encode(image, fmt="WEBP", quality=85):
+    fmt = fmt.upper()
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format {fmt!r}")
+    options = {"quality": quality}
+    if fmt == "WEBP":
+        options["method"] = 4
+    elif fmt == "JPEG":
+        options.update(optimize=True, progressive=True)
+    elif fmt == "PNG":
+        options = {"optimize": True}
+    if fmt in ("JPEG", "WEBP", "AVIF") and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buffer = BytesIO()
+    image.save(buffer, format=fmt, **options)
+    return buffer.getvalue()
+
+
+def run_pipeline(data, steps, fmt="WEBP", quality=85):
+    """Apply ``steps`` to encoded image ``data``; returns (encoded bytes, [(stage, seconds)])."""
+    from PIL import Image
+
+    timings = []
+    started = time.perf_counter()
+    with Image.open(BytesIO(data)) as source:
+        image = source.convert("RGB")
+    timings.append(("decode", time.perf_counter() - started))
+
+    for name, argument in steps:
+        started = time.perf_counter()
+        image = STAGES[name][0](image, argument)
+        timings.append((name, time.perf_counter() - started))
+
+    started = time.perf_counter()
+    output = encode(image, fmt, quality)
+    timings.append(("encode", time.perf_counter() - started))
+    return output, timings
+
+
+class PostProcessor:
+    """Runs pipelines on a lazily started process pool (inline when ``workers`` is 0)."""
+
+    def __init__(self, workers=POSTPROCESS_WORKERS):
+        self.workers = workers
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+
+                # spawn, not fork: forking a threaded server can deadlock the child
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def submit(self, data, steps, fmt="WEBP", quality=85):
+        """Future of ``run_pipeline(...)``; timings are recorded once it completes."""
+        if self.workers <= 0:
+            future = Future()
+            try:
+                future.set_result(run_pipeline(data, steps, fmt, quality))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            future = self._executor().submit(run_pipeline, data, steps, fmt, quality)
+        future.add_done_callback(_record)
+        return future
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+
+
+def _record(future):
+    if future.cancelled() or future.exception() is not None:
+        return
+    _, timings = future.result()
+    for stage, seconds in timings:
+        observe("postprocess_seconds", seconds, stage=stage)
+    inc("postprocessed_images")
+
+
+postprocessor = PostProcessor()
@@ -0,0 +1,52 @@
+import hashlib
+from io import BytesIO
+
+from nexus.config import env_int
+from nexus.generation import sniff_format
+from nexus.lru import LRUCache
+
+PREVIEW_SIZE = env_int("NEXUS_PREVIEW_SIZE", 512)
+
+# Formats st.image can forward without decoding and re-encoding
+PASSTHROUGH_FORMATS = {"png": "PNG", "jpeg": "JPEG", "gif": "GIF"}
+
+_previews = LRUCache(
+    env_int("NEXUS_PREVIEW_CACHE_ENTRIES", 64),
+    max_bytes=env_int("NEXUS_PREVIEW_CACHE_MB", 32) * 1024 * 1024,
+)
+
+
+def digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def output_format(data):
+    """The st.image ``output_format`` that lets ``data`` through untouched, or "auto"."""
+    return PASSTHROUGH_FORMATS.get(sniff_format(data), "auto")
+
+
+def make_preview(data, max_side=PREVIEW_SIZE):
+    """Downscaled JPEG of an encoded image for grid display.
+
+    Images already within ``max_side`` come back unchanged. Previews are
+    memoized by content hash, so reruns don't decode the original again.
+    """
+    key = (digest(data), max_side)
+    preview = _previews.get(key)
+    if preview is not None:
+        return preview
+
+    from PIL import Image
+
+    with Image.open(BytesIO(data)) as image:
+        if max(image.size) <= max_side:
+            preview = data
+        else:
+            image.draft("RGB", (max_side, max_side))  # cheap DCT scaling for JPEG sources
+            image.thumbnail((max_side, max_side))
+            buffer = BytesIO()
+            image.convert("RGB").save(buffer, format="JPEG", quality=85)
+            preview = buffer.getvalue()
+
+    _previews.put(key, preview)
+    return preview
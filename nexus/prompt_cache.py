@@ -0,0 +1,38 @@
+import re
+
+from nexus.config import env_float, env_int
+from nexus.lru import LRUCache
+from nexus.metrics import metrics
+
+PROMPT_CACHE_SIZE = env_int("NEXUS_PROMPT_CACHE_SIZE", 2048)
+PROMPT_CACHE_TTL = env_float("NEXUS_PROMPT_CACHE_TTL", 24 * 3600)
+
+
+def normalize_idea(idea):
+    """Case- and whitespace-insensitive form of a prompt idea."""
+    return re.sub(r"\s+", " ", idea).strip().lower()
+
+
+class PromptCache:
+    """Expanded prompts shared by every session, keyed on (model, normalized idea).
+
+    ``backend`` is anything with ``get(key)`` and ``put(key, value)``; the
+    default is an in-process LRU with a TTL.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or LRUCache(PROMPT_CACHE_SIZE, ttl=PROMPT_CACHE_TTL)
+
+    def get(self, model, idea):
+        return self.backend.get((model, normalize_idea(idea)))
+
+    def put(self, model, idea, prompt):
+        self.backend.put((model, normalize_idea(idea)), prompt)
+
+    def stats(self):
+        stats = getattr(self.backend, "stats", None)
+        return stats() if stats else {}
+
+
+prompt_cache = PromptCache()
+metrics.register("prompt_cache", prompt_cache.stats)
@@ -0,0 +1,274 @@
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from functools import partial
+from types import SimpleNamespace
+
+from nexus.config import env_float, env_int
+from nexus.metrics import metrics
+from nexus.usage import count_tokens, usage
+
+RATE_LIMIT = env_float("NEXUS_RATE_LIMIT", 2.0)
+RATE_BURST = env_int("NEXUS_RATE_BURST", 4)
+MAX_RETRIES = env_int("NEXUS_MAX_RETRIES", 3)
+QUEUE_TIMEOUT = env_float("NEXUS_QUEUE_TIMEOUT", 60.0)
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+RETRYABLE_ERRORS = {"APIConnectionError", "APITimeoutError", "ServiceUnavailableError", "Timeout"}
+
+
+class RequestDropped(Exception):
+    """The request waited longer than the queue timeout for its turn."""
+
+
+def is_retryable(error):
+    status = getattr(error, "status_code", None) or getattr(error, "http_status", None)
+    return status in RETRYABLE_STATUS or type(error).__name__ in RETRYABLE_ERRORS
+
+
+def retry_after(error):
+    """Seconds the provider asked us to wait, from Retry-After(-Ms) headers, or None."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or getattr(error, "headers", None) or {}
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        import email.utils
+
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self._clock = clock
+        self._updated = clock()
+        self._paused_until = 0.0
+
+    def try_acquire(self):
+        """Take a token; returns 0 on success or the seconds until one is available."""
+        now = self._clock()
+        if now < self._paused_until:
+            return self._paused_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else 1.0
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, self._clock() + seconds)
+
+
+class _KeyQueue:
+    def __init__(self, rate, burst):
+        self.bucket = TokenBucket(rate, burst)
+        self.cond = threading.Condition()
+        # session -> its waiting tickets; the first session in order is served next
+        self.sessions = OrderedDict()
+
+
+class Scheduler:
+    """Rate limiting and retries in front of every provider call.
+
+    Each API key gets a token bucket shared by all sessions using it.
+    Waiting requests are granted tokens round-robin across sessions, so one
+    session's burst can't starve the others. Retryable failures back off
+    exponentially with full jitter, or as long as Retry-After says. A 429
+    also pauses the whole key's bucket.
+    """
+
+    def __init__(self, rate=RATE_LIMIT, burst=RATE_BURST, max_retries=MAX_RETRIES,
+                 queue_timeout=QUEUE_TIMEOUT, base_delay=0.5, max_delay=30.0):
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.queue_timeout = queue_timeout
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.queued = 0
+        self.total_queued = 0
+        self.retried = 0
+        self.dropped = 0
+        self.completed = 0
+
+    def _count(self, name, delta=1):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + delta)
+
+    def _queue(self, key):
+        with self._lock:
+            if key not in self._queues:
+                self._queues[key] = _KeyQueue(self.rate, self.burst)
+            return self._queues[key]
+
+    def _acquire(self, queue, session):
+        ticket = object()
+        deadline = time.monotonic() + self.queue_timeout
+        self._count("queued")
+        self._count("total_queued")
+        try:
+            with queue.cond:
+                queue.sessions.setdefault(session, deque()).append(ticket)
+                while True:
+                    first = next(iter(queue.sessions))
+                    wait = None
+                    if queue.sessions[first][0] is ticket:
+                        wait = queue.bucket.try_acquire()
+                        if wait == 0:
+                            # Served: move this session to the back of the rotation
+                            tickets = queue.sessions.pop(first)
+                            tickets.popleft()
+                            if tickets:
+                                queue.sessions[first] = tickets
+                            queue.cond.notify_all()
+                            return
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        tickets = queue.sessions[session]
+                        tickets.remove(ticket)
+                        if not tickets:
+                            del queue.sessions[session]
+                        queue.cond.notify_all()
+                        self._count("dropped")
+                        raise RequestDropped(
+                            f"Request waited more than {self.queue_timeout:g}s in the rate-limit queue"
+                        )
+                    queue.cond.wait(min(wait, remaining) if wait is not None else remaining)
+        finally:
+            self._count("queued", -1)
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, key, fn, *args, session=None, **kwargs):
+        """Run ``fn(*args, **kwargs)`` once a token for ``key`` is free, retrying transient errors."""
+        queue = self._queue(key)
+        for attempt in range(self.max_retries + 1):
+            self._acquire(queue, session)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                if attempt == self.max_retries:
+                    self._count("dropped")
+                    raise
+                delay = retry_after(e)
+                if delay is None:
+                    delay = self.backoff(attempt)
+                elif delay > self.queue_timeout:
+                    # Waiting that long would hold a worker longer than any queued request may wait
+                    self._count("dropped")
+                    raise RequestDropped(f"The API asked to retry after {delay:g}s") from e
+                delay = min(delay, self.max_delay)
+                if getattr(e, "status_code", None) == 429:
+                    with queue.cond:
+                        queue.bucket.pause(delay)
+                self._count("retried")
+                time.sleep(delay)
+            else:
+                self._count("completed")
+                return result
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "queued": self.queued,
+                "total_queued": self.total_queued,
+                "retried": self.retried,
+                "dropped": self.dropped,
+                "completed": self.completed,
+            }
+
+
+class ScheduledClient:
+    """Drop-in stand-in for a Together client whose calls go through a Scheduler.
+
+    Calls are also metered by ``meter`` (see ``nexus.usage``), which refuses
+    them before they are queued once a quota is used up.
+    """
+
+    def __init__(self, client, scheduler, key, session=None, meter=None):
+        self.client = client
+        self.key = key
+        self.session = session
+        self.meter = meter or usage
+        self._call = partial(scheduler.call, key, session=session)
+        self.images = SimpleNamespace(generate=self._generate_images)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create_completion))
+
+    def _timed(self, fn, **kwargs):
+        """Scheduled ``fn(**kwargs)``; returns (result, seconds spent in the provider, queueing excluded)."""
+        elapsed = [0.0]
+
+        def attempt(**kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(**kwargs)
+            finally:
+                elapsed[0] += time.perf_counter() - started
+
+        result = self._call(attempt, **kwargs)
+        return result, elapsed[0]
+
+    def _generate_images(self, **params):
+        cost = self.meter.reserve_images(self.key, self.session, params)
+        try:
+            response, seconds = self._timed(self.client.images.generate, **params)
+        except BaseException:
+            self.meter.refund_images(self.key, self.session, cost)
+            raise
+        self.meter.record_images(self.key, self.session, params, seconds)
+        return response
+
+    def _create_completion(self, **request):
+        self.meter.check_tokens(self.key, self.session)
+        response, seconds = self._timed(self.client.chat.completions.create, **request)
+        if request.get("stream"):
+            return self._metered_stream(response, request, seconds)
+        choices = getattr(response, "choices", None)
+        text = choices[0].message.content if choices else ""
+        tokens_in, tokens_out = count_tokens(request.get("messages"), text, getattr(response, "usage", None))
+        self.meter.record_tokens(self.key, self.session, tokens_in, tokens_out, seconds)
+        return response
+
+    def _metered_stream(self, chunks, request, seconds):
+        """Pass the chunks through, then record the tokens once the stream ends (or is dropped)."""
+        started = time.perf_counter()
+        text = []
+        reported = None
+        try:
+            for chunk in chunks:
+                reported = getattr(chunk, "usage", None) or reported
+                if chunk.choices and chunk.choices[0].delta.content:
+                    text.append(chunk.choices[0].delta.content)
+                yield chunk
+        finally:
+            tokens_in, tokens_out = count_tokens(request.get("messages"), "".join(text), reported)
+            self.meter.record_tokens(self.key, self.session, tokens_in, tokens_out,
+                                     seconds + time.perf_counter() - started)
+
+
+scheduler = Scheduler()
+metrics.register("scheduler", scheduler.stats)
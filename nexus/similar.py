@@ -0,0 +1,153 @@
+"""Near-duplicate prompt search over the generation history.
+
+Prompts are normalized (case, punctuation, whitespace and word order don't
+matter) and turned into shingles: the words plus character 4-grams of the
+sorted word string, which also catches small spelling differences. Each
+prompt gets a MinHash signature. The signatures go into an LSH table of
+``bands`` buckets, so a lookup only compares against prompts that share a
+bucket, and stays fast with tens of thousands of entries. Candidates are
+then ranked by their exact Jaccard similarity.
+"""
+
+import re
+import threading
+
+from nexus.config import env_float, env_int
+from nexus.metrics import metrics
+
+SIMILARITY_THRESHOLD = env_float("NEXUS_SIMILAR_THRESHOLD", 0.7)
+NUM_PERM = env_int("NEXUS_MINHASH_PERMUTATIONS", 64)
+BANDS = env_int("NEXUS_MINHASH_BANDS", 16)
+SHINGLE_SIZE = 4
+
+_MERSENNE = (1 << 61) - 1
+
+
+def normalize_prompt(prompt):
+    """Lowercased words without punctuation, deduplicated and sorted."""
+    return " ".join(sorted(set(re.findall(r"\w+", prompt.lower()))))
+
+
+def shingles(prompt):
+    text = normalize_prompt(prompt)
+    result = set(text.split())
+    result.update(text[i:i + SHINGLE_SIZE] for i in range(max(1, len(text) - SHINGLE_SIZE + 1)))
+    return frozenset(result)
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+class MinHash:
+    """``num_perm`` universal hash functions (a*x + b mod 2^61-1), applied with NumPy."""
+
+    def __init__(self, num_perm=NUM_PERM, seed=1):
+        import numpy as np
+
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+    def signature(self, items):
+        import numpy as np
+
+        # The index lives in one process, so the per-process salt of hash() doesn't matter
+        values = np.fromiter((hash(item) & 0xFFFFFFFF for item in items), dtype=np.uint64)
+        if not len(values):
+            return np.zeros(len(self.a), dtype=np.uint64)
+        # a, b and x are < 2^32, so a * x + b can't overflow 64 bits
+        hashed = (np.outer(values, self.a) + self.b) % _MERSENNE
+        return hashed.min(axis=0)
+
+
+class SimilarityIndex:
+    """MinHash/LSH index of prompts keyed by an id (the history generation id)."""
+
+    def __init__(self, num_perm=NUM_PERM, bands=BANDS, threshold=SIMILARITY_THRESHOLD):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self._minhash = None  # built on first use: keeps NumPy out of app startup
+        self._buckets = [{} for _ in range(bands)]
+        self._shingles = {}
+        self._prompts = {}
+        self._lock = threading.Lock()
+        self.last_id = 0
+
+    def __len__(self):
+        return len(self._shingles)
+
+    def _signature(self, items):
+        if self._minhash is None:
+            self._minhash = MinHash(self.num_perm)
+        return self._minhash.signature(items)
+
+    def _band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def add(self, key, prompt):
+        items = shingles(prompt)
+        band_keys = self._band_keys(self._signature(items))
+        with self._lock:
+            self._shingles[key] = items
+            self._prompts[key] = prompt
+            for bucket, band_key in zip(self._buckets, band_keys):
+                bucket.setdefault(band_key, []).append(key)
+            if isinstance(key, int):
+                self.last_id = max(self.last_id, key)
+
+    def query(self, prompt, limit=5, threshold=None):
+        """[(similarity, key, prompt)] for indexed prompts at least ``threshold`` similar, best first."""
+        threshold = self.threshold if threshold is None else threshold
+        items = shingles(prompt)
+        band_keys = self._band_keys(self._signature(items))
+        with self._lock:
+            candidates = set()
+            for bucket, band_key in zip(self._buckets, band_keys):
+                candidates.update(bucket.get(band_key, ()))
+            scored = [(jaccard(items, self._shingles[key]), key, self._prompts[key]) for key in candidates]
+        scored = [match for match in scored if match[0] >= threshold]
+        scored.sort(key=lambda match: match[0], reverse=True)
+        return scored[:limit]
+
+    def stats(self):
+        return {"prompts": len(self), "last_id": self.last_id}
+
+
+class HistoryIndex(SimilarityIndex):
+    """SimilarityIndex that pulls new image generations from the history store before each query.
+
+    It remembers which key made each entry, so a query only matches that key's own renders.
+    """
+
+    def __init__(self, store=None, **kwargs):
+        super().__init__(**kwargs)
+        self._store = store
+        self._owners = {}
+        self._refresh_lock = threading.Lock()
+
+    def refresh(self):
+        if self._store is None:
+            from nexus.history import history
+
+            self._store = history
+        with self._refresh_lock:
+            for generation_id, prompt, owner in self._store.prompts(kind="image", after_id=self.last_id):
+                self._owners[generation_id] = owner
+                self.add(generation_id, prompt)
+
+    def query(self, prompt, limit=5, threshold=None, owner=None):
+        """Like SimilarityIndex.query; with ``owner`` (a key fingerprint), only that key's entries."""
+        self.refresh()
+        if owner is None:
+            return super().query(prompt, limit=limit, threshold=threshold)
+        matches = super().query(prompt, limit=len(self), threshold=threshold)
+        return [match for match in matches if self._owners.get(match[1]) == owner][:limit]
+
+
+similar_prompts = HistoryIndex()
+metrics.register("similar_prompts", similar_prompts.stats)
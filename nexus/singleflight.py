@@ -0,0 +1,151 @@
+"""Single-flight coalescing of identical in-flight generations.
+
+When several sessions ask for the same ``images.generate`` params at the
+same time with the same API key, only the first request reaches the provider. The others attach
+to its flight and receive the same results as they arrive. A flight runs
+on its own thread, so one subscriber cancelling doesn't take it down for
+the rest. It is abandoned only when every subscriber has left: the
+producer is told straight away, so it can skip requests it hasn't sent.
+An error raised by the provider call reaches every subscriber; errors
+that only concern the leader (its quota, its queue) are for the caller
+to tell apart, see ``on_join``.
+"""
+
+import threading
+
+from nexus.image_cache import cache_key
+from nexus.metrics import inc, metrics
+
+CANCEL_POLL_SECONDS = 0.2
+
+
+class Flight:
+    def __init__(self, key):
+        self.key = key
+        self.events = []
+        self.done = False
+        self.error = None
+        self.abandoned = False
+        self.subscribers = 0
+        self.cond = threading.Condition()
+
+    def publish(self, event):
+        with self.cond:
+            self.events.append(event)
+            self.cond.notify_all()
+
+    def finish(self, error=None):
+        with self.cond:
+            self.error = error
+            self.done = True
+            self.cond.notify_all()
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.flights = 0
+        self.coalesced = 0
+        self.abandoned = 0
+
+    def _join(self, key):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight(key)
+                self.flights += 1
+            else:
+                self.coalesced += 1
+                inc("coalesced_requests")
+            with flight.cond:
+                flight.subscribers += 1
+            return flight, leader
+
+    def _leave(self, flight):
+        with self._lock, flight.cond:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                # Nobody is waiting any more: stop, and let the next request start afresh
+                flight.abandoned = True
+                self.abandoned += 1
+                if self._flights.get(flight.key) is flight:
+                    del self._flights[flight.key]
+
+    def _run(self, flight, producer, on_complete):
+        events = []
+        try:
+            # Abandoning doesn't break this loop: what the producer still yields was paid for
+            for event in producer(lambda: flight.abandoned):
+                events.append(event)
+                flight.publish(event)
+            if on_complete is not None:
+                on_complete(events)
+        except BaseException as e:
+            flight.finish(e)
+        else:
+            flight.finish()
+        finally:
+            with self._lock:
+                if self._flights.get(flight.key) is flight:
+                    del self._flights[flight.key]
+
+    def stream(self, params, producer, on_complete=None, cancelled=None, scope=None, on_join=None):
+        """Yield the events of ``producer(cancelled)`` (e.g. ``iter_images(...)``),
+        shared with every concurrent caller passing identical ``params``.
+
+        The producer's ``cancelled()`` turns true once every caller has left.
+        ``on_complete(events)`` runs once per flight when the producer is done,
+        with fewer events if the flight was abandoned part way.
+        Closing the generator detaches this caller, and so does
+        ``cancelled()`` turning true while it waits (the generator then
+        just stops).
+
+        Only callers with the same ``scope`` (e.g. the API key's fingerprint)
+        share a flight, so a call is never made with another caller's
+        credentials. ``on_join(leader)`` is told whether this caller started
+        the flight or joined one that was already running.
+        """
+        flight, leader = self._join((scope, cache_key(params)))
+        if on_join is not None:
+            on_join(leader)
+        if leader:
+            threading.Thread(
+                target=self._run,
+                args=(flight, producer, on_complete),
+                name="nexus-flight",
+                daemon=True,
+            ).start()
+        seen = 0
+        try:
+            while True:
+                with flight.cond:
+                    while len(flight.events) <= seen and not flight.done:
+                        if cancelled is not None and cancelled():
+                            return
+                        flight.cond.wait(CANCEL_POLL_SECONDS)
+                    events = flight.events[seen:]
+                    done, error = flight.done, flight.error
+                seen += len(events)
+                yield from events
+                if done:
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            self._leave(flight)
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._flights)
+        return {
+            "in_flight": in_flight,
+            "flights": self.flights,
+            "coalesced": self.coalesced,
+            "abandoned": self.abandoned,
+        }
+
+
+coalescer = SingleFlight()
+metrics.register("coalescer", coalescer.stats)
@@ -0,0 +1,106 @@
+"""Memory soak test: RSS over many simulated generations.
+
+    python -m nexus.soak --generations 500 --sessions 8
+    python -m nexus.soak --generations 2000 --session-mb 16 --global-mb 64 --json soak.json
+
+Runs image jobs against FakeTogether through the same path the app uses
+(job queue, image cache, history, previews) in a throwaway data directory.
+It samples RSS and the bytes each in-process store retains. A bounded
+footprint shows up as RSS levelling off once the budgets are full; the
+run fails (exit 1) when growth over the second half exceeds --max-growth.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Track RSS over many simulated generations")
+    parser.add_argument("--generations", type=int, default=500)
+    parser.add_argument("--sessions", type=int, default=8, help="Simulated sessions, used round-robin")
+    parser.add_argument("--concurrency", type=int, default=4, help="Jobs in flight at once")
+    parser.add_argument("--n", type=int, default=2, help="Images per generation")
+    parser.add_argument("--size", type=int, default=1024, help="Image width and height")
+    parser.add_argument("--unique", type=int, default=0,
+                        help="Distinct prompts (0 = every generation is new, i.e. no cache hits)")
+    parser.add_argument("--session-mb", type=int, help="Override NEXUS_SESSION_IMAGE_MB")
+    parser.add_argument("--global-mb", type=int, help="Override NEXUS_JOB_IMAGE_MB")
+    parser.add_argument("--samples", type=int, default=20, help="RSS samples over the run")
+    parser.add_argument("--max-growth", type=float, default=50.0,
+                        help="Allowed RSS growth over the second half, in MB (default: %(default)s)")
+    parser.add_argument("--json", help="Also write the samples to this file")
+    args = parser.parse_args(argv)
+
+    data_dir = tempfile.mkdtemp(prefix="nexus-soak-")
+    # Settings are read at import time, so configure before importing the app's modules
+    os.environ["NEXUS_DATA_DIR"] = data_dir
+    if args.session_mb is not None:
+        os.environ["NEXUS_SESSION_IMAGE_MB"] = str(args.session_mb)
+    if args.global_mb is not None:
+        os.environ["NEXUS_JOB_IMAGE_MB"] = str(args.global_mb)
+
+    from nexus.benchmark import PROMPT, peak_rss_mb, rss_mb
+    from nexus.fake_together import FakeTogether
+    from nexus.generation import image_params
+    from nexus.image_cache import image_cache
+    from nexus.jobs import jobs, run_image_job
+    from nexus.previews import _previews, make_preview
+    from nexus.scheduler import ScheduledClient, Scheduler
+
+    fake = FakeTogether(text_latency=0, token_latency=0, image_latency=0, jitter=0)
+    client = ScheduledClient(fake, Scheduler(rate=1e6, burst=10 ** 6), "soak")
+    unique = args.unique or args.generations
+    every = max(1, args.generations // args.samples)
+
+    samples = []
+    started_rss = rss_mb()
+    print(f"{'generations':>12}{'rss MB':>10}{'jobs MB':>10}{'cache MB':>10}{'previews MB':>13}{'released':>10}")
+    pending = []
+    for g in range(1, args.generations + 1):
+        params = image_params(f"{PROMPT} #{g % unique}", model="fake/image", steps=20, n=args.n,
+                              width=args.size, height=args.size)
+        pending.append(jobs.submit(run_image_job, params, session=f"soak-{g % args.sessions}",
+                                   client=client, parallel=args.n))
+        if len(pending) >= args.concurrency:
+            for job in pending:
+                job.future.result()
+                for result in job.results:
+                    if isinstance(result, bytes):
+                        make_preview(result)  # what rendering the grid does
+            pending = []
+        if g % every == 0 or g == args.generations:
+            stats = jobs.stats()
+            sample = {
+                "generations": g,
+                "rss_mb": rss_mb(),
+                "jobs_mb": stats["bytes"] / 2 ** 20,
+                "image_cache_mb": image_cache.stats()["memory_bytes"] / 2 ** 20,
+                "previews_mb": _previews.bytes / 2 ** 20,
+                "released": stats["released"],
+            }
+            samples.append(sample)
+            print(f"{g:>12}{sample['rss_mb']:>10.1f}{sample['jobs_mb']:>10.1f}{sample['image_cache_mb']:>10.1f}"
+                  f"{sample['previews_mb']:>13.1f}{sample['released']:>10}")
+
+    half = samples[len(samples) // 2:]
+    growth = max(s["rss_mb"] for s in half) - half[0]["rss_mb"]
+    bounded = growth <= args.max_growth
+    print(f"RSS {started_rss:.1f} -> {samples[-1]['rss_mb']:.1f} MB (peak {peak_rss_mb():.1f}); "
+          f"growth over the second half {growth:.1f} MB: {'bounded' if bounded else 'NOT bounded'}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(
+            {"args": vars(args), "samples": samples, "second_half_growth_mb": growth, "bounded": bounded},
+            indent=2,
+        ))
+    shutil.rmtree(data_dir, ignore_errors=True)
+    return 0 if bounded else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
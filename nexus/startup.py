@@ -0,0 +1,90 @@
+"""Startup profile for app.py: import-time breakdown and first-rerun latency.
+
+    python -m nexus.startup
+
+Cold start imports everything app.py imports in a fresh interpreter under
+``-X importtime`` and groups the cost by top-level package. The rerun
+section runs the script twice with AppTest (first run vs. a warm rerun).
+It also lists which heavy optional modules got loaded without any
+generation happening; they should all be loaded lazily.
+"""
+
+import argparse
+import ast
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+APP = Path(__file__).resolve().parent.parent / "app.py"
+
+# Only needed once something is actually generated or decoded
+LAZY_MODULES = ("together", "httpx", "PIL.Image", "requests", "numpy", "http.server")
+
+
+def app_imports(app=APP):
+    """Top-level module names imported by app.py, in source order."""
+    modules = []
+    for node in ast.parse(app.read_text(encoding="utf-8")).body:
+        if isinstance(node, ast.Import):
+            modules += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+
+def import_profile(modules, cwd=APP.parent):
+    """Run the imports in a fresh interpreter; returns (wall seconds, {package: seconds})."""
+    code = "import " + ", ".join(modules)
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=cwd, capture_output=True, text=True, check=True,
+    )
+    wall = time.perf_counter() - started
+
+    packages = defaultdict(float)
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        if name.startswith("  ") or not cumulative.strip().isdigit():
+            continue  # nested import, already counted in its parent's cumulative time
+        packages[name.strip().split(".")[0]] += int(cumulative) / 1e6
+    return wall, dict(packages)
+
+
+def rerun_profile(app=APP):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(str(app), default_timeout=60)
+    started = time.perf_counter()
+    at.run()
+    first = time.perf_counter() - started
+    started = time.perf_counter()
+    at.run()
+    second = time.perf_counter() - started
+    loaded = [name for name in LAZY_MODULES if name in sys.modules]
+    return first, second, loaded
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile app.py cold start and first rerun")
+    parser.add_argument("--top", type=int, default=15, help="Packages to list (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    modules = app_imports()
+    wall, packages = import_profile(modules)
+    print(f"cold start: {wall:.2f}s to start Python and import {', '.join(modules)}")
+    for package, seconds in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {seconds * 1000:>8.1f} ms  {package}")
+
+    first, second, loaded = rerun_profile()
+    print(f"first run: {first * 1000:.0f} ms, warm rerun: {second * 1000:.0f} ms")
+    print(f"heavy modules loaded before any generation: {', '.join(loaded) or 'none'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
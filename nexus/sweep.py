@@ -0,0 +1,94 @@
+"""Parameter sweeps: one image per combination of prompt, model, resolution and steps.
+
+The cells of a sweep are independent ``n=1`` requests. They are deduplicated,
+served from the image cache where possible, and the rest run on a bounded
+pool so a large grid can't monopolize the API key.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import product
+
+from nexus.config import env_int
+from nexus.generation import generate_images, image_params
+from nexus.history import history
+from nexus.image_cache import cache_key, image_cache
+from nexus.jobs import JobCancelled
+from nexus.usage import usage
+
+SWEEP_MAX_CELLS = env_int("NEXUS_SWEEP_MAX_CELLS", 64)
+STEP_CHOICES = [1, 2, 4, 8, 12, 20, 28, 36, 50]
+RESOLUTIONS = ["512x512", "768x768", "1024x1024", "1024x768", "768x1024"]
+
+
+def parse_resolution(resolution):
+    width, height = resolution.lower().split("x")
+    return int(width), int(height)
+
+
+def sweep_cells(prompts, models, steps_values, resolutions, negative_prompt=""):
+    """Every combination as ``images.generate`` params, duplicates removed, grid order kept."""
+    cells = {}
+    for prompt, model, resolution, steps in product(prompts, models, resolutions, sorted(steps_values)):
+        width, height = parse_resolution(resolution)
+        params = image_params(prompt, model=model, steps=steps, n=1, width=width, height=height,
+                              negative_prompt=negative_prompt)
+        cells.setdefault(cache_key(params), params)
+    return list(cells.values())
+
+
+def sweep_rows(cells):
+    """Lay cells out as a matrix: one row per (prompt, model, resolution), one column per steps value.
+
+    Returns ``(steps columns, [(row params, [cell index or None per column])])``.
+    """
+    columns = sorted({cell["steps"] for cell in cells})
+    rows = {}
+    for index, cell in enumerate(cells):
+        row_key = (cell["prompt"], cell["model"], cell["width"], cell["height"])
+        row = rows.setdefault(row_key, (cell, [None] * len(columns)))
+        row[1][columns.index(cell["steps"])] = index
+    return columns, list(rows.values())
+
+
+def run_sweep_job(job, client, parallel=4, use_cache=True):
+    """Fill ``job.results[i]`` for each of ``job.params["cells"]``, at most ``parallel`` at a time.
+
+    Cells already in the image cache are filled before anything is sent.
+    """
+    cells = job.params["cells"]
+    pending = []
+    for i, params in enumerate(cells):
+        cached = image_cache.get(params) if use_cache else None
+        if cached:
+            job.results[i] = cached[0]
+            job.cached += 1
+            usage.record_saved(getattr(client, "key", None), job.session, params)
+            history.record_images(params, cached, session=job.session, owner=getattr(client, "key", None))
+        else:
+            pending.append(i)
+
+    def one(i):
+        if job.cancel_requested:
+            return None
+        started = time.perf_counter()
+        results = generate_images(client, cells[i])
+        if results and all(isinstance(result, bytes) for result in results):
+            image_cache.put(cells[i], results)
+        history.record_images(cells[i], results, seconds=time.perf_counter() - started, session=job.session,
+                              owner=getattr(client, "key", None))
+        return results[0] if results else None
+
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+        futures = {executor.submit(one, i): i for i in pending}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                job.results[i] = future.result()
+            except Exception as e:
+                job.errors[i] = str(e)
+            if job.cancel_requested:
+                for other in futures:
+                    other.cancel()
+    if job.cancel_requested:
+        raise JobCancelled()
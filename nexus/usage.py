@@ -0,0 +1,220 @@
+"""Usage accounting and quotas per API key and per session.
+
+Every provider call made through a ``ScheduledClient`` is metered here:
+pixel-steps for images (width × height × steps × n), prompt and completion
+tokens for chat, and the wall time spent in the provider call. Results
+served from a cache are counted as savings instead. Optional quotas per key
+and per session are checked before a request is queued, so a runaway session
+is stopped before it eats the throughput everyone shares. Quotas apply to
+fixed windows of ``NEXUS_QUOTA_WINDOW`` seconds; totals are kept for the
+life of the process.
+"""
+
+import threading
+import time
+
+from nexus.config import env_float, env_int
+from nexus.lru import LRUCache
+from nexus.metrics import inc, metrics
+
+MEGA = 1_000_000
+
+# 0 means no limit. Image quotas are in megapixel-steps: one 1024x1024 image at 20 steps is ~21
+SESSION_QUOTA_MPS = env_float("NEXUS_SESSION_QUOTA_MPS", 0)
+KEY_QUOTA_MPS = env_float("NEXUS_KEY_QUOTA_MPS", 0)
+SESSION_QUOTA_TOKENS = env_int("NEXUS_SESSION_QUOTA_TOKENS", 0)
+KEY_QUOTA_TOKENS = env_int("NEXUS_KEY_QUOTA_TOKENS", 0)
+QUOTA_WINDOW = env_float("NEXUS_QUOTA_WINDOW", 3600)
+MAX_SESSIONS = env_int("NEXUS_USAGE_MAX_SESSIONS", 4096)
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+def pixel_steps(params):
+    return params.get("width", 1024) * params.get("height", 1024) * params.get("steps", 20) * params.get("n", 1)
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token) for when the provider doesn't report usage."""
+    return max(1, len(text) // 4) if text else 0
+
+
+def count_tokens(messages, text, reported=None):
+    """(prompt tokens, completion tokens): as reported by the provider, else estimated."""
+    if reported is not None and getattr(reported, "prompt_tokens", None) is not None:
+        return reported.prompt_tokens, reported.completion_tokens or 0
+    prompt = "".join(str(message.get("content", "")) for message in messages or ())
+    return estimate_tokens(prompt), estimate_tokens(text)
+
+
+class Account:
+    """Running totals for one key or session, plus what it used in the current quota window."""
+
+    def __init__(self, now):
+        self.calls = 0
+        self.images = 0
+        self.pixel_steps = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.seconds = 0.0
+        self.saved_images = 0
+        self.saved_pixel_steps = 0
+        self.saved_tokens = 0
+        self.rejected = 0
+        self.window_start = now
+        self.window_pixel_steps = 0
+        self.window_tokens = 0
+
+    def roll(self, now, window):
+        if now - self.window_start >= window:
+            self.window_start = now
+            self.window_pixel_steps = 0
+            self.window_tokens = 0
+
+    def snapshot(self):
+        return {
+            "calls": self.calls,
+            "images": self.images,
+            "pixel_steps": self.pixel_steps,
+            "tokens_in": self.tokens_in,
+            "tokens_out": self.tokens_out,
+            "seconds": self.seconds,
+            "saved_images": self.saved_images,
+            "saved_pixel_steps": self.saved_pixel_steps,
+            "saved_tokens": self.saved_tokens,
+            "rejected": self.rejected,
+            "window_pixel_steps": self.window_pixel_steps,
+            "window_tokens": self.window_tokens,
+        }
+
+
+class UsageMeter:
+    def __init__(self, session_quota_mps=SESSION_QUOTA_MPS, key_quota_mps=KEY_QUOTA_MPS,
+                 session_quota_tokens=SESSION_QUOTA_TOKENS, key_quota_tokens=KEY_QUOTA_TOKENS,
+                 window=QUOTA_WINDOW, max_sessions=MAX_SESSIONS, clock=time.monotonic):
+        self.quotas = {
+            "session": (session_quota_mps * MEGA, session_quota_tokens),
+            "key": (key_quota_mps * MEGA, key_quota_tokens),
+        }
+        self.window = window
+        self._clock = clock
+        self._keys = {}
+        # Idle sessions are forgotten after a day; their work still counts for the key
+        self._sessions = LRUCache(max_sessions, ttl=24 * 3600, sliding=True)
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _accounts(self, key, session):
+        """[(scope, account)] to charge, after rolling their quota windows over if due."""
+        now = self._clock()
+        accounts = []
+        if key is not None:
+            accounts.append(("key", self._keys.setdefault(key, Account(now))))
+        if session is not None:
+            account = self._sessions.get(session)
+            if account is None:
+                account = Account(now)
+                self._sessions.put(session, account)
+            accounts.append(("session", account))
+        for _, account in accounts:
+            account.roll(now, self.window)
+        return accounts
+
+    def _reject(self, scope, account, message):
+        account.rejected += 1
+        self.rejected += 1
+        inc("quota_rejections", scope=scope)
+        resets = max(0, self.window - (self._clock() - account.window_start))
+        raise QuotaExceeded(f"{message} in the {scope} quota; it resets in {resets / 60:.0f} min")
+
+    def reserve_images(self, key, session, params):
+        """Reserve ``params``' pixel-steps against the quotas before dispatch, or raise QuotaExceeded."""
+        cost = pixel_steps(params)
+        with self._lock:
+            accounts = self._accounts(key, session)
+            for scope, account in accounts:
+                limit = self.quotas[scope][0]
+                if limit and account.window_pixel_steps + cost > limit:
+                    left = max(0, limit - account.window_pixel_steps)
+                    self._reject(scope, account, f"This needs {cost / MEGA:,.0f} megapixel-steps, "
+                                                 f"only {left / MEGA:,.0f} of {limit / MEGA:,.0f} are left")
+            for _, account in accounts:
+                account.window_pixel_steps += cost
+        return cost
+
+    def refund_images(self, key, session, cost):
+        """Give back a reservation whose call failed."""
+        with self._lock:
+            for _, account in self._accounts(key, session):
+                account.window_pixel_steps = max(0, account.window_pixel_steps - cost)
+
+    def record_images(self, key, session, params, seconds):
+        with self._lock:
+            for _, account in self._accounts(key, session):
+                account.calls += 1
+                account.images += params.get("n", 1)
+                account.pixel_steps += pixel_steps(params)
+                account.seconds += seconds
+        inc("pixel_steps", pixel_steps(params))
+
+    def check_tokens(self, key, session):
+        """Raise QuotaExceeded if a token quota is already used up (the cost of a chat call isn't known upfront)."""
+        with self._lock:
+            for scope, account in self._accounts(key, session):
+                limit = self.quotas[scope][1]
+                if limit and account.window_tokens >= limit:
+                    self._reject(scope, account, f"All {limit:,} tokens are used")
+
+    def record_tokens(self, key, session, tokens_in, tokens_out, seconds):
+        with self._lock:
+            for _, account in self._accounts(key, session):
+                account.calls += 1
+                account.tokens_in += tokens_in
+                account.tokens_out += tokens_out
+                account.window_tokens += tokens_in + tokens_out
+                account.seconds += seconds
+        inc("tokens", tokens_in, direction="in")
+        inc("tokens", tokens_out, direction="out")
+
+    def record_saved(self, key, session, params=None, tokens=0):
+        """Work a cache answered instead of the provider: ``params`` of images, or ``tokens``."""
+        with self._lock:
+            for _, account in self._accounts(key, session):
+                if params is not None:
+                    account.saved_images += params.get("n", 1)
+                    account.saved_pixel_steps += pixel_steps(params)
+                account.saved_tokens += tokens
+
+    def usage(self, key=None, session=None):
+        """Snapshots of the key's and the session's accounts, with their quotas: {scope: {...}}."""
+        with self._lock:
+            result = {}
+            for scope, account in self._accounts(key, session):
+                mps_limit, token_limit = self.quotas[scope]
+                result[scope] = dict(
+                    account.snapshot(),
+                    quota_pixel_steps=mps_limit,
+                    quota_tokens=token_limit,
+                    window_resets_in=max(0, self.window - (self._clock() - account.window_start)),
+                )
+            return result
+
+    def stats(self):
+        with self._lock:
+            accounts = list(self._keys.values())
+        return {
+            "keys": len(accounts),
+            "sessions": len(self._sessions),
+            "pixel_steps": sum(account.pixel_steps for account in accounts),
+            "tokens_in": sum(account.tokens_in for account in accounts),
+            "tokens_out": sum(account.tokens_out for account in accounts),
+            "seconds": sum(account.seconds for account in accounts),
+            "saved_pixel_steps": sum(account.saved_pixel_steps for account in accounts),
+            "rejected": self.rejected,
+        }
+
+
+usage = UsageMeter()
+metrics.register("usage", usage.stats)
@@ -0,0 +1,68 @@
+"""Repeated identical image requests are answered by the image cache, not the provider."""
+
+import pytest
+
+from nexus import jobs
+from nexus.fake_together import FakeTogether
+from nexus.generation import generate_images, image_params
+from nexus.history import HistoryStore
+from nexus.image_cache import ImageCache
+
+PARAMS = image_params("a lighthouse at dusk", steps=4, n=2, width=256, height=256)
+
+
+@pytest.fixture
+def fake():
+    return FakeTogether(image_latency=0, text_latency=0, jitter=0)
+
+
+def cached_generate(cache, client, params):
+    """What the app does for one request: serve it from the cache, else generate and store it."""
+    images = cache.get(params)
+    if images is None:
+        images = generate_images(client, params)
+        cache.put(params, images)
+    return images
+
+
+def test_second_identical_request_is_served_from_cache(tmp_path, fake):
+    cache = ImageCache(directory=tmp_path)
+    first = cached_generate(cache, fake, PARAMS)
+    second = cached_generate(cache, fake, PARAMS)
+    assert second == first
+    assert fake.calls["images"] == 1
+
+
+def test_disk_tier_serves_a_fresh_memory_tier(tmp_path, fake):
+    first = cached_generate(ImageCache(directory=tmp_path), fake, PARAMS)
+    # A new instance starts with an empty memory tier, like a restarted server
+    second = cached_generate(ImageCache(directory=tmp_path), fake, PARAMS)
+    assert second == first
+    assert fake.calls["images"] == 1
+
+
+def test_different_params_miss(tmp_path, fake):
+    cache = ImageCache(directory=tmp_path)
+    cached_generate(cache, fake, PARAMS)
+    cached_generate(cache, fake, dict(PARAMS, steps=8))
+    assert fake.calls["images"] == 2
+
+
+def test_image_jobs_share_the_cache(tmp_path, fake, monkeypatch):
+    monkeypatch.setattr(jobs, "image_cache", ImageCache(directory=tmp_path / "cache"))
+    monkeypatch.setattr(jobs, "history", HistoryStore(tmp_path / "history"))
+    first, second = jobs.Job(PARAMS), jobs.Job(PARAMS)
+    jobs.run_image_job(first, fake)
+    jobs.run_image_job(second, fake)
+    assert not first.from_cache and second.from_cache
+    assert second.results == first.results
+    assert fake.calls["images"] == 1
+
+
+def test_contains_does_not_count_as_a_hit(tmp_path, fake):
+    cache = ImageCache(directory=tmp_path)
+    assert PARAMS not in cache
+    cached_generate(cache, fake, PARAMS)
+    assert PARAMS in cache
+    assert PARAMS in ImageCache(directory=tmp_path)  # from the disk tier alone
+    assert cache.stats()["hits"] == 0
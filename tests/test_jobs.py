@@ -0,0 +1,113 @@
+"""Image jobs: history entries, memory budgets, fair dispatch and cancellation."""
+
+import threading
+import time
+
+import pytest
+
+from nexus import jobs
+from nexus.fake_together import FakeTogether
+from nexus.generation import image_params
+from nexus.history import HistoryStore
+from nexus.image_cache import ImageCache
+from nexus.scheduler import ScheduledClient, Scheduler
+from nexus.usage import UsageMeter
+
+PARAMS = image_params("a lighthouse at dusk", steps=4, n=2, width=256, height=256)
+
+
+@pytest.fixture
+def fake():
+    return FakeTogether(image_latency=0, text_latency=0, jitter=0)
+
+
+@pytest.fixture
+def stores(tmp_path, monkeypatch):
+    cache, history = ImageCache(directory=tmp_path / "cache"), HistoryStore(tmp_path / "history")
+    monkeypatch.setattr(jobs, "image_cache", cache)
+    monkeypatch.setattr(jobs, "history", history)
+    return cache, history
+
+
+def client(fake, key, session=None):
+    return ScheduledClient(fake, Scheduler(), key, session=session, meter=UsageMeter())
+
+
+def test_cache_hit_is_saved_to_the_callers_history(fake, stores):
+    _, history = stores
+    queue = jobs.JobQueue(session_bytes=0)
+    first = queue.submit(jobs.run_image_job, PARAMS, session="a", client=client(fake, "keyA"))
+    first.future.result()
+    second = queue.submit(jobs.run_image_job, PARAMS, session="b", client=client(fake, "keyB"))
+    second.future.result()
+    assert second.from_cache and fake.calls["images"] == 1
+    assert history.count(owner="keyB") == 1
+    assert history.get(second.generation_id, owner="keyB")["images"][0]["sha"]
+    # Now released from memory, the results can still be opened from the history
+    queue.enforce_budgets()
+    assert second.released
+
+
+def test_jobs_missing_from_history_are_not_released(fake, stores):
+    queue = jobs.JobQueue(session_bytes=0)
+    job = queue.submit(jobs.run_image_job, PARAMS, session="a", client=client(fake, "keyA"), record=False)
+    job.future.result()
+    queue.enforce_budgets()
+    assert not job.released and job.generation_id is None
+
+
+def test_a_busy_session_does_not_hold_every_worker(stores):
+    slow, quick = FakeTogether(image_latency=2, jitter=0), FakeTogether(image_latency=0, jitter=0)
+    queue = jobs.JobQueue(max_workers=4, session_jobs=2)
+    params = lambda i: image_params(f"slow {i}", steps=20, width=256, height=256)
+    busy = [queue.submit(jobs.run_image_job, params(i), session="a", client=slow, use_cache=False)
+            for i in range(8)]
+    job = queue.submit(jobs.run_image_job, PARAMS, session="b", client=quick, use_cache=False)
+    job.future.result(timeout=1)
+    assert job.status == jobs.DONE
+    assert sum(busy_job.status == jobs.RUNNING for busy_job in busy) == 2
+    assert queue.stats()["sessions_waiting"] == 1
+    for busy_job in busy:
+        queue.cancel(busy_job.id)
+
+
+def test_sessions_waiting_for_a_worker_take_turns(stores):
+    queue = jobs.JobQueue(max_workers=1, session_jobs=1)
+    gate, started = threading.Event(), []
+
+    def record(job, name):
+        started.append(name)
+
+    blocker = queue.submit(lambda job: gate.wait(5), {}, session="x")  # holds the only worker
+    last = [queue.submit(record, {}, session=name[0], name=name) for name in ("a1", "a2", "a3", "b1", "b2", "c1")]
+    gate.set()
+    blocker.future.result()
+    for job in last:
+        job.future.result(timeout=1)
+    assert started == ["a1", "b1", "c1", "a2", "b2", "a3"]
+
+
+def test_cancelling_a_waiting_job_skips_it(fake, stores):
+    queue = jobs.JobQueue(max_workers=1, session_jobs=1)
+    slow = FakeTogether(image_latency=0.5, jitter=0)
+    first = queue.submit(jobs.run_image_job, PARAMS, session="a", client=slow, use_cache=False)
+    second = queue.submit(jobs.run_image_job, dict(PARAMS, steps=8), session="a", client=slow, use_cache=False)
+    assert queue.cancel(second.id) and second.status == jobs.CANCELLED
+    first.future.result()
+    assert slow.calls["images"] == 1
+
+
+def test_cancel_skips_requests_not_yet_sent_and_caches_the_paid_ones(stores):
+    cache, _ = stores
+    slow = FakeTogether(image_latency=0.5, jitter=0)
+    queue = jobs.JobQueue()
+    params = image_params("cancelled part way", steps=20, n=4, width=1024, height=1024)
+    job = queue.submit(jobs.run_image_job, params, session="a", client=slow, parallel=2)
+    time.sleep(0.2)  # the first two requests are in flight, the other two queued
+    queue.cancel(job.id)
+    deadline = time.monotonic() + 3
+    while dict(params, n=2) not in cache and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert job.status == jobs.CANCELLED
+    assert slow.calls["images"] == 2
+    assert len(cache.get(dict(params, n=2))) == 2
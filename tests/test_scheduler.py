@@ -0,0 +1,115 @@
+"""Rate limiting, fair queueing and retries in front of provider calls."""
+
+import threading
+import time
+
+import pytest
+
+from nexus.fake_together import FakeAPIError
+from nexus.scheduler import RequestDropped, Scheduler, TokenBucket
+
+
+def rate_limited(retry_after=None):
+    error = FakeAPIError(429, "Simulated rate limit")
+    if retry_after is not None:
+        error.response.headers["retry-after"] = str(retry_after)
+    return error
+
+
+def test_token_bucket_refills_at_its_rate():
+    now = [0.0]
+    bucket = TokenBucket(rate=2, capacity=2, clock=lambda: now[0])
+    assert bucket.try_acquire() == 0 and bucket.try_acquire() == 0
+    assert bucket.try_acquire() == pytest.approx(0.5)
+    now[0] = 0.5
+    assert bucket.try_acquire() == 0
+
+
+def test_token_bucket_pause():
+    now = [0.0]
+    bucket = TokenBucket(rate=100, capacity=10, clock=lambda: now[0])
+    bucket.pause(3)
+    assert bucket.try_acquire() == pytest.approx(3)
+    now[0] = 3
+    assert bucket.try_acquire() == 0
+
+
+def test_sessions_sharing_a_key_are_served_in_turn():
+    scheduler = Scheduler(rate=20, burst=1)
+    scheduler.call("key", lambda: None, session="warm-up")  # takes the only token
+    served = []
+    threads = []
+    for name in ("a1", "a2", "a3", "b1", "b2", "c1"):
+        thread = threading.Thread(target=scheduler.call, args=("key", served.append, name), kwargs={"session": name[0]})
+        thread.start()
+        threads.append(thread)
+        # Queue them in this order (a1 may already have been served)
+        while sum(map(len, scheduler._queue("key").sessions.values())) + len(served) < len(threads):
+            time.sleep(0.001)
+    for thread in threads:
+        thread.join()
+    assert served == ["a1", "b1", "c1", "a2", "b2", "a3"]
+
+
+def test_request_dropped_after_queue_timeout():
+    scheduler = Scheduler(rate=0.01, burst=1, queue_timeout=0.2)
+    scheduler.call("key", lambda: None)
+    started = time.monotonic()
+    with pytest.raises(RequestDropped):
+        scheduler.call("key", lambda: None)
+    assert 0.2 <= time.monotonic() - started < 1
+    assert scheduler.stats()["dropped"] == 1
+
+
+def test_retry_after_past_the_queue_timeout_drops_the_request():
+    scheduler = Scheduler(queue_timeout=1)
+    calls = []
+
+    def fn():
+        calls.append(1)
+        raise rate_limited(retry_after=3600)
+
+    started = time.monotonic()
+    with pytest.raises(RequestDropped):
+        scheduler.call("key", fn)
+    assert len(calls) == 1 and time.monotonic() - started < 1
+
+
+def test_retry_after_is_capped_at_max_delay():
+    scheduler = Scheduler(queue_timeout=10, max_delay=0.1)
+    attempts = []
+
+    def fn():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise rate_limited(retry_after=5)
+        return "ok"
+
+    started = time.monotonic()
+    assert scheduler.call("key", fn) == "ok"
+    assert time.monotonic() - started < 1
+    assert scheduler.stats()["retried"] == 1
+
+
+def test_rate_limit_pauses_the_whole_key():
+    scheduler = Scheduler(rate=1000, burst=10, max_delay=1)
+    limited = threading.Event()
+    limited_at = []
+
+    def fn():
+        if not limited_at:
+            limited_at.append(time.monotonic())
+            limited.set()
+            raise rate_limited(retry_after=0.3)
+
+    thread = threading.Thread(target=scheduler.call, args=("key", fn), kwargs={"session": "a"})
+    thread.start()
+    limited.wait(1)
+    # Another session on the same key has to wait out the pause too, tokens or not
+    served_at = scheduler.call("key", time.monotonic, session="b")
+    thread.join()
+    assert served_at - limited_at[0] >= 0.25
+    # Other keys are not affected
+    started = time.monotonic()
+    scheduler.call("other-key", lambda: None)
+    assert time.monotonic() - started < 0.1
@@ -0,0 +1,82 @@
+"""Identical image requests in flight share one provider call, but only within one API key."""
+
+import time
+
+import pytest
+
+from nexus import jobs
+from nexus.fake_together import FakeTogether
+from nexus.generation import image_params
+from nexus.history import HistoryStore
+from nexus.image_cache import ImageCache
+from nexus.scheduler import ScheduledClient, Scheduler
+from nexus.singleflight import coalescer
+from nexus.usage import QuotaExceeded, UsageMeter
+
+PARAMS = image_params("two sessions, one prompt", steps=20, n=2, width=1024, height=1024)
+
+
+class SlowQuotaMeter(UsageMeter):
+    """Takes a moment to turn a request down, so the follower joins the flight first."""
+
+    def reserve_images(self, key, session, params):
+        time.sleep(0.3)
+        return super().reserve_images(key, session, params)
+
+
+@pytest.fixture
+def fake():
+    return FakeTogether(image_latency=0.3, jitter=0)
+
+
+@pytest.fixture(autouse=True)
+def stores(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "image_cache", ImageCache(directory=tmp_path / "cache"))
+    monkeypatch.setattr(jobs, "history", HistoryStore(tmp_path / "history"))
+
+
+def run_pair(leader, follower, parallel=1):
+    queue = jobs.JobQueue()
+    first = queue.submit(jobs.run_image_job, PARAMS, session=leader.session, client=leader, parallel=parallel)
+    time.sleep(0.05)
+    second = queue.submit(jobs.run_image_job, PARAMS, session=follower.session, client=follower, parallel=parallel)
+    first.future.result()
+    second.future.result()
+    return first, second
+
+
+def test_different_keys_do_not_share_a_call(fake):
+    scheduler = Scheduler()
+    a = ScheduledClient(fake, scheduler, "keyA", session="a", meter=UsageMeter())
+    b = ScheduledClient(fake, scheduler, "keyB", session="b", meter=UsageMeter())
+    first, second = run_pair(a, b)
+    assert first.status == second.status == jobs.DONE
+    assert fake.calls["images"] == 2
+
+
+def test_same_key_shares_a_call(fake):
+    scheduler, meter = Scheduler(), UsageMeter()
+    a = ScheduledClient(fake, scheduler, "keyA", session="a", meter=meter)
+    b = ScheduledClient(fake, scheduler, "keyA", session="b", meter=meter)
+    coalesced = coalescer.coalesced
+    first, second = run_pair(a, b)
+    assert first.status == second.status == jobs.DONE
+    assert second.results == first.results
+    assert fake.calls["images"] == 1
+    assert coalescer.coalesced == coalesced + 1
+
+
+@pytest.mark.parametrize("parallel", [1, 2])
+def test_leaders_quota_does_not_fail_the_follower(fake, parallel):
+    scheduler = Scheduler()
+    # 1 megapixel-step: every 1024x1024 request of the leader's session is turned down
+    leader = ScheduledClient(fake, scheduler, "keyA", session="poor", meter=SlowQuotaMeter(session_quota_mps=1))
+    follower_meter = UsageMeter()
+    follower = ScheduledClient(fake, scheduler, "keyA", session="rich", meter=follower_meter)
+    coalesced = coalescer.coalesced
+    first, second = run_pair(leader, follower, parallel=parallel)
+    assert coalescer.coalesced == coalesced + 1  # the follower did join the leader's flight
+    assert first.status == jobs.FAILED and isinstance(first.error, QuotaExceeded)
+    assert second.status == jobs.DONE and not second.errors
+    assert all(isinstance(result, bytes) for result in second.results)
+    assert follower_meter.usage("keyA", "rich")["session"]["images"] == 2